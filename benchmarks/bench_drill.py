@@ -0,0 +1,62 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# Copyright 2019 Hiroshi Murayama <opiopan@gmail.com>
+
+# Measure DrillComposition.dump() time for increasing number of tools while
+# total number of hits is fixed. emission is a single pass over hits grouped
+# by tool, so dump time should not grow with number of tools.
+# 'scan' column shows time of previous emission which scans all hits for
+# each tool.
+#
+#   usage: python bench_drill.py [number of hits]
+
+import sys, os, time, random, tempfile
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+import gerberex
+from gerber.excellon_statements import ToolSelectionStmt
+
+HEADER = 'M48\n;FILE_FORMAT=2:4\nMETRIC,TZ\n'
+
+def generate(num_tools, num_hits):
+    random.seed(0)
+    lines = [HEADER]
+    for tool in range(1, num_tools + 1):
+        lines.append('T%02dC%.3f\n' % (tool, 0.3 + tool * 0.05))
+    lines.append('%\nG90\n')
+    per_tool = num_hits // num_tools
+    for tool in range(1, num_tools + 1):
+        lines.append('T%02d\n' % tool)
+        for n in range(per_tool):
+            lines.append('X%dY%d\n' % (random.randint(0, 999999), random.randint(0, 999999)))
+    lines.append('M30\n')
+    return ''.join(lines)
+
+def scan(ctx):
+    lines = []
+    for tool in ctx.tools:
+        lines.append(ToolSelectionStmt(tool.number).to_excellon(ctx.settings))
+        for tool_map, hits in ctx.hits:
+            for hit in hits:
+                if tool_map[hit.tool.number] is tool:
+                    lines.append(hit.to_excellon(ctx.settings))
+    return lines
+
+def measure(num_tools, num_hits, path):
+    drill = gerberex.loads(generate(num_tools, num_hits), 'bench.txt')
+    ctx = gerberex.DrillComposition()
+    ctx.merge(drill)
+    start = time.perf_counter()
+    ctx.dump(path)
+    dump_time = time.perf_counter() - start
+    start = time.perf_counter()
+    scan(ctx)
+    scan_time = time.perf_counter() - start
+    print('%5d tools %8d hits  dump %7.3f sec  scan %7.3f sec' % (
+        num_tools, num_hits, dump_time, scan_time))
+
+if __name__ == '__main__':
+    num_hits = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+    with tempfile.TemporaryDirectory() as directory:
+        for num_tools in (1, 10, 100, 400):
+            measure(num_tools, num_hits, os.path.join(directory, 'bench.txt'))
@@ -0,0 +1,36 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# Copyright 2019 Hiroshi Murayama <opiopan@gmail.com>
+
+# Compare load time and peak memory of gerberex.loads() between default mode
+# and statements only lean mode on a large synthetic copper layer.
+#
+#   usage: python bench_load.py [number of coordinate blocks]
+
+import sys, os, time, gc, tracemalloc
+sys.path.insert(0, os.path.dirname(__file__))
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+import gerberex
+from bench_parse import generate
+
+def measure(name, data, lean):
+    gc.collect()
+    tracemalloc.start()
+    start = time.perf_counter()
+    file = gerberex.loads(data, 'bench.gtl', lean=lean)
+    elapsed = time.perf_counter() - start
+    current, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    print('%-8s %9d statements %8.3f sec  peak %8.1f MB  retained %8.1f MB' % (
+        name, len(file.main_statements), elapsed, peak / 1e6, current / 1e6))
+    return elapsed, peak
+
+if __name__ == '__main__':
+    num = int(sys.argv[1]) if len(sys.argv) > 1 else 200000
+    data = generate(num)
+    print('%d coordinate blocks, %.1f MB' % (num, len(data) / 1e6))
+    base_time, base_peak = measure('default', data, False)
+    lean_time, lean_peak = measure('lean', data, True)
+    print('load time: -%.1f%%  peak memory: -%.1f%%' % (
+        (1 - lean_time / base_time) * 100, (1 - lean_peak / base_peak) * 100))
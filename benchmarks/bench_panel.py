@@ -0,0 +1,170 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# Copyright 2019 Hiroshi Murayama <opiopan@gmail.com>
+
+# End-to-end panelization benchmark modeled on examples/panelize.py.
+# Layer sets of a few synthetic board designs, an outline DXF and a mouse
+# bites DXF are generated, then panels of increasing number of boards are
+# built by PanelBuilder.
+# For each panel, wall time of whole build is measured, and each layer is
+# built again in a fresh process to record its wall time, peak RSS and
+# output size. baseline_rss is peak RSS of a fresh process doing nothing.
+#
+#   usage: python bench_panel.py [-b BOARDS ...] [-j WORKERS] [-o RESULT.json]
+
+import sys, os, time, math, json, argparse, tempfile
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+sys.path.insert(0, os.path.dirname(__file__))
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+from gerberex import DxfFile, MergeJob, PanelBuilder
+from gerberex.panel import build_layer
+from bench_suite import environment
+import synthetic
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+BOARD_SIZE = 20
+GAP = 2
+DESIGNS = 3
+ANGLES = (0, 90, 180, 270)
+
+# number of coordinate blocks, apertures and macros of each gerber layer
+GERBER_LAYERS = {
+    'GTL': (1000, 20, 3), 'GBL': (800, 20, 3),
+    'GTO': (500, 2, 0), 'GBO': (200, 2, 0),
+    'GTS': (300, 12, 2), 'GBS': (250, 12, 2),
+    'GTP': (200, 8, 1), 'GBP': (80, 8, 1),
+}
+# number of hits, routs and tools of drill layer
+DRILL_LAYER = ('TXT', (150, 2, 6))
+
+def generate_boards(directory):
+    area = (0, 0, BOARD_SIZE, BOARD_SIZE)
+    boards = {}
+    for design in range(DESIGNS):
+        layers = {}
+        for layer, (coords, apertures, macros) in GERBER_LAYERS.items():
+            layers[layer] = synthetic.gerber(coords, apertures, macros, design, area)
+        layer, (hits, routs, tools) = DRILL_LAYER
+        layers[layer] = synthetic.excellon(hits, routs, tools, design, area)
+        name = 'board%d' % design
+        boards[name] = {}
+        for layer, data in layers.items():
+            path = os.path.join(directory, '%s.%s' % (name, layer))
+            with open(path, 'w') as f:
+                f.write(data)
+            boards[name][layer] = path
+    return boards
+
+def placements(num):
+    # boards are placed in a grid and rotated around origin, so that offset
+    # is adjusted to keep each board in its cell
+    columns = int(math.ceil(math.sqrt(num)))
+    pitch = BOARD_SIZE + GAP
+    adjustments = {0: (0, 0), 90: (BOARD_SIZE, 0), 180: (BOARD_SIZE, BOARD_SIZE),
+                   270: (0, BOARD_SIZE)}
+    result = []
+    for n in range(num):
+        angle = ANGLES[n % len(ANGLES)]
+        dx, dy = adjustments[angle]
+        left, bottom = GAP + n % columns * pitch, GAP + n // columns * pitch
+        result.append(('board%d' % (n % DESIGNS), left + dx, bottom + dy, angle))
+    return result, columns
+
+def generate_outline(num, columns, path):
+    # panel frame and board outlines as closed polylines
+    pitch = BOARD_SIZE + GAP
+    rows = int(math.ceil(num / float(columns)))
+    entities = [synthetic._dxf_polyline(
+        ((0, 0), (columns * pitch + GAP, 0), (columns * pitch + GAP, rows * pitch + GAP),
+         (0, rows * pitch + GAP)))]
+    for n in range(num):
+        left, bottom = GAP + n % columns * pitch, GAP + n // columns * pitch
+        entities.append(synthetic._dxf_polyline(
+            ((left, bottom), (left + BOARD_SIZE, bottom),
+             (left + BOARD_SIZE, bottom + BOARD_SIZE), (left, bottom + BOARD_SIZE))))
+    _write_dxf(path, entities)
+
+def generate_mousebites(num, columns, path):
+    # tabs in the gaps on the right and the top of each board
+    pitch = BOARD_SIZE + GAP
+    middle = BOARD_SIZE / 2.
+    entities = []
+    for n in range(num):
+        left, bottom = GAP + n % columns * pitch, GAP + n // columns * pitch
+        x, y = left + BOARD_SIZE + GAP / 2., bottom + BOARD_SIZE + GAP / 2.
+        entities.append(synthetic._dxf_line((x, bottom + middle - 2), (x, bottom + middle + 2)))
+        entities.append(synthetic._dxf_line((left + middle - 2, y), (left + middle + 2, y)))
+    _write_dxf(path, entities)
+
+def _write_dxf(path, entities):
+    with open(path, 'w') as f:
+        f.write(''.join(['0\nSECTION\n2\nHEADER\n9\n$INSUNITS\n70\n4\n0\nENDSEC\n',
+                         '0\nSECTION\n2\nENTITIES\n'] + entities + ['0\nENDSEC\n0\nEOF\n']))
+
+def measure_layer(task=None):
+    # runs in a fresh process, returns elapsed time and peak RSS in bytes
+    elapsed = build_layer(*task) if task is not None else 0.
+    rss = None
+    if resource is not None:
+        rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        rss *= 1 if sys.platform == 'darwin' else 1024
+    return elapsed, rss
+
+def isolated(task=None):
+    context = multiprocessing.get_context('spawn')
+    with ProcessPoolExecutor(1, mp_context=context) as executor:
+        return executor.submit(measure_layer, task).result()
+
+def run(counts, workers):
+    results = []
+    baseline = isolated()[1]
+    with tempfile.TemporaryDirectory() as directory:
+        boards = generate_boards(directory)
+        for num in counts:
+            panel, columns = placements(num)
+            outline = os.path.join(directory, 'outline%d.dxf' % num)
+            mousebites = os.path.join(directory, 'mousebites%d.dxf' % num)
+            generate_outline(num, columns, outline)
+            generate_mousebites(num, columns, mousebites)
+            extras = dict((layer, [MergeJob(outline)]) for layer in GERBER_LAYERS)
+            extras[DRILL_LAYER[0]] = [MergeJob(mousebites, units='metric', attributes={
+                'draw_mode': DxfFile.DM_MOUSE_BITES, 'width': 0.5, 'format': (3, 3)})]
+            builder = PanelBuilder(boards, panel, extras, workers=workers)
+            def output(layer):
+                return os.path.join(directory, 'panel%d.%s' % (num, layer))
+            start = time.perf_counter()
+            builder.build(output)
+            wall = time.perf_counter() - start
+            sys.stderr.write('%5d boards: %8.3f sec\n' % (num, wall))
+            layers = {}
+            for task in builder.tasks(output):
+                layer = task[0]
+                elapsed, rss = isolated(task)
+                size = os.path.getsize(output(layer))
+                layers[layer] = {'seconds': elapsed, 'peak_rss': rss, 'output_size': size}
+                sys.stderr.write('  %-4s %8.3f sec %8.1f MB rss %9.1f KB output\n' % (
+                    layer, elapsed, (rss or 0) / 1e6, size / 1e3))
+            results.append({'boards': num, 'seconds': wall, 'layers': layers})
+    return {'environment': environment(), 'workers': workers, 'baseline_rss': baseline,
+            'results': results}
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-b', '--boards', type=int, action='append',
+                        help='number of boards in a panel (default: 1, 10, 100 and 1000)')
+    parser.add_argument('-j', '--workers', type=int, default=None)
+    parser.add_argument('-o', '--output', help='file to write JSON result')
+    args = parser.parse_args()
+    report = run(args.boards or [1, 10, 100, 1000], args.workers)
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+    else:
+        json.dump(report, sys.stdout, indent=2)
+        sys.stdout.write('\n')
@@ -0,0 +1,60 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# Copyright 2019 Hiroshi Murayama <opiopan@gmail.com>
+
+# Compare parse throughput of RS-274x coordinate data between regex chain of
+# pcb-tools GerberParser and fast path tokenizer of gerberex.
+#
+#   usage: python bench_parse.py [number of coordinate blocks]
+
+import sys, os, time, random
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+import gerber.rs274x
+import gerberex.rs274x
+
+HEADER = '%MOMM*%\n%FSLAX34Y34*%\n%ADD10C,0.2*%\n%ADD11R,1X0.5*%\nG75*\n%LPD*%\n'
+
+def generate(num):
+    random.seed(0)
+    lines = [HEADER]
+    for n in range(num):
+        x = random.randint(-1000000, 1000000)
+        y = random.randint(-1000000, 1000000)
+        kind = n % 10
+        if kind == 0:
+            lines.append('D%d*\n' % (10 + n % 2))
+        elif kind == 1:
+            lines.append('X%dY%dD02*\n' % (x, y))
+        elif kind == 2:
+            lines.append('G03X%dY%dI%dJ%dD01*\n' % (x, y, x // 2, y // 2))
+        elif kind == 3:
+            lines.append('X%dY%dD03*\n' % (x, y))
+        else:
+            lines.append('G01X%dY%dD01*\n' % (x, y))
+    lines.append('M02*\n')
+    return ''.join(lines)
+
+def measure(name, parse, data):
+    start = time.perf_counter()
+    count = sum(1 for _ in parse(data))
+    elapsed = time.perf_counter() - start
+    print('%-10s %9d statements %8.3f sec %10.0f statements/sec %7.2f MB/sec' % (
+        name, count, elapsed, count / elapsed, len(data) / elapsed / 1e6))
+    return elapsed
+
+def pcb_tools(data):
+    parser = gerber.rs274x.GerberParser()
+    return parser._parse(parser._split_commands(data))
+
+def fast_path(data):
+    parser = gerberex.rs274x.GerberParser()
+    return parser._parse(parser._split_commands(data))
+
+if __name__ == '__main__':
+    num = int(sys.argv[1]) if len(sys.argv) > 1 else 500000
+    data = generate(num)
+    print('%d coordinate blocks, %.1f MB' % (num, len(data) / 1e6))
+    base = measure('pcb-tools', pcb_tools, data)
+    fast = measure('gerberex', fast_path, data)
+    print('speedup: x%.2f' % (base / fast))
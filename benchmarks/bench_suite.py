@@ -0,0 +1,162 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# Copyright 2019 Hiroshi Murayama <opiopan@gmail.com>
+
+# Micro benchmarks of basic operations on synthetic Gerber, Excellon and DXF
+# data at several sizes. Results are written as JSON, and two result files
+# can be compared to find performance regressions between commits.
+#
+#   usage: python bench_suite.py [-s SIZE ...] [-r REPEAT] [-o RESULT.json]
+#          python bench_suite.py --compare BASE.json RESULT.json
+
+import sys, os, copy, time, json, argparse, platform, subprocess, tempfile
+sys.path.insert(0, os.path.dirname(__file__))
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+import gerberex
+import gerberex.rs274x
+from gerberex.dxf_path import generate_paths
+import synthetic
+
+SIZES = {
+    'small': dict(coords=1000, apertures=10, macros=2, hits=1000, routs=20, tools=5,
+                  polylines=10, arcs=10),
+    'medium': dict(coords=10000, apertures=50, macros=10, hits=10000, routs=200, tools=20,
+                   polylines=50, arcs=50),
+    'large': dict(coords=100000, apertures=200, macros=40, hits=100000, routs=2000, tools=50,
+                  polylines=200, arcs=200),
+}
+
+def flush(file):
+    # deferred transformations are applied when statements are referred
+    if isinstance(file, gerberex.rs274x.GerberFile):
+        file.drawing_statements()
+    elif isinstance(file, gerberex.excellon.ExcellonFileEx):
+        file.hits
+        file.statements
+    else:
+        file.statements.open_paths
+    return file
+
+def operations(name, data, composition, directory):
+    # returns list of (operation name, setup, run). run takes result of setup
+    source = gerberex.loads(data, name)
+    output = os.path.join(directory, name)
+    def transformed(operation):
+        def run(file):
+            operation(file)
+            flush(file)
+        return (source.clone, run)
+    def merged():
+        ctx = composition()
+        ctx.merge(source.clone())
+        return ctx
+    result = [
+        ('read', lambda: data, lambda data: gerberex.loads(data, name)),
+        ('rotate',) + transformed(lambda file: file.rotate(30)),
+        ('offset',) + transformed(lambda file: file.offset(10, 20)),
+        ('to_metric',) + transformed(lambda file: (file.to_inch(), file.to_metric())),
+        ('merge', composition, lambda ctx: ctx.merge(source.clone())),
+        ('dump', merged, lambda ctx: ctx.dump(output)),
+    ]
+    if name.endswith('.dxf'):
+        statements = source.statements
+        def containment():
+            statements.sorted_close_paths = []
+            return statements
+        # generate_paths() merges and reverses entities in place, so each run
+        # takes a copy of entities which are never processed
+        result += [
+            ('generate_paths', lambda: copy.deepcopy(statements.statements),
+             lambda entities: generate_paths(entities, statements.error_range)),
+            ('judge_containment', containment,
+             lambda statements: statements._prepare_sorted_close_paths()),
+        ]
+    return result
+
+def inputs(size):
+    params = SIZES[size]
+    return [
+        ('gerber', 'bench.gtl', gerberex.GerberComposition,
+         synthetic.gerber(params['coords'], params['apertures'], params['macros'])),
+        ('excellon', 'bench.txt', gerberex.DrillComposition,
+         synthetic.excellon(params['hits'], params['routs'], params['tools'])),
+        ('dxf', 'bench.dxf', gerberex.GerberComposition,
+         synthetic.dxf(params['polylines'], params['arcs'])),
+    ]
+
+def measure(setup, run, repeat):
+    # the best of repeated runs
+    best = None
+    for num in range(repeat):
+        argument = setup()
+        start = time.perf_counter()
+        run(argument)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+def environment():
+    try:
+        commit = subprocess.check_output(
+            ['git', 'rev-parse', '--short', 'HEAD'], cwd=os.path.dirname(__file__) or '.',
+            stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    return {
+        'commit': commit,
+        'gerberex': gerberex.__version__,
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'numpy': gerberex.rs274x.is_columns_available(),
+    }
+
+def run(sizes, repeat):
+    results = []
+    with tempfile.TemporaryDirectory() as directory:
+        for size in sizes:
+            for kind, name, composition, data in inputs(size):
+                for operation, setup, body in operations(name, data, composition, directory):
+                    elapsed = measure(setup, body, repeat)
+                    results.append({'size': size, 'format': kind, 'operation': operation,
+                                    'seconds': elapsed})
+                    sys.stderr.write('%-7s %-9s %-18s %9.4f sec\n' % (
+                        size, kind, operation, elapsed))
+    return {'environment': environment(), 'sizes': dict((s, SIZES[s]) for s in sizes),
+            'repeat': repeat, 'results': results}
+
+def compare(base, target):
+    def table(report):
+        return dict(((r['size'], r['format'], r['operation']), r['seconds'])
+                    for r in report['results'])
+    base_table = table(base)
+    print('%-7s %-9s %-18s %10s %10s %8s' % ('size', 'format', 'operation', 'base', 'target',
+                                            'ratio'))
+    for key, seconds in table(target).items():
+        if key in base_table:
+            print('%-7s %-9s %-18s %10.4f %10.4f %7.2fx' % (
+                key + (base_table[key], seconds, seconds / max(base_table[key], 1e-9))))
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-s', '--size', action='append', choices=sorted(SIZES),
+                        help='data size (default: small and medium)')
+    parser.add_argument('-r', '--repeat', type=int, default=3)
+    parser.add_argument('-o', '--output', help='file to write JSON result')
+    parser.add_argument('--compare', nargs=2, metavar=('BASE', 'TARGET'),
+                        help='compare two result files')
+    args = parser.parse_args()
+    if args.compare:
+        reports = []
+        for path in args.compare:
+            with open(path) as f:
+                reports.append(json.load(f))
+        compare(*reports)
+        sys.exit(0)
+    report = run(args.size or ['small', 'medium'], args.repeat)
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+    else:
+        json.dump(report, sys.stdout, indent=2)
+        sys.stdout.write('\n')
@@ -0,0 +1,50 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# Copyright 2019 Hiroshi Murayama <opiopan@gmail.com>
+
+# Compare output formatting throughput of RS-274x main statements between
+# to_gerber() of pcb-tools statements, scalar formatter and columnar formatter
+# of gerberex. data is rotated before output so that coordinates are
+# transformed as well.
+#
+#   usage: python bench_write.py [number of coordinate blocks]
+
+import sys, os, time
+sys.path.insert(0, os.path.dirname(__file__))
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+import gerberex
+from gerberex.rs274x import format_statements
+from bench_parse import generate
+
+def legacy(file):
+    return [s.to_gerber(file.context) for s in file.main_statements]
+
+def scalar(file):
+    return list(format_statements(file.main_statements, file.context))
+
+def columnar(file):
+    statements, columns = file.drawing_statements()
+    return list(format_statements(statements, file.context, columns))
+
+def measure(name, output, source):
+    file = source.clone()
+    file.rotate(30)
+    start = time.perf_counter()
+    lines = output(file)
+    elapsed = time.perf_counter() - start
+    print('%-9s %9d lines %8.3f sec %10.0f lines/sec' % (
+        name, len(lines), elapsed, len(lines) / elapsed))
+    return lines
+
+if __name__ == '__main__':
+    num = int(sys.argv[1]) if len(sys.argv) > 1 else 200000
+    source = gerberex.loads(generate(num), 'bench.gtl', lean=True)
+    expect = measure('legacy', legacy, source)
+    if measure('scalar', scalar, source) != expect:
+        raise Exception('scalar formatter output differs')
+    if gerberex.rs274x.is_columns_available():
+        if measure('columnar', columnar, source) != expect:
+            raise Exception('columnar formatter output differs')
+    else:
+        print('columnar formatter is skipped since numpy is not installed')
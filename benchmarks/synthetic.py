@@ -0,0 +1,117 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# Copyright 2019 Hiroshi Murayama <opiopan@gmail.com>
+
+# Generators of synthetic input data for benchmarks. Each generator returns
+# text of a file and output is deterministic for same arguments.
+#
+#   gerber(coords, apertures, macros)   RS-274x data
+#   excellon(hits, routs, tools)        Excellon NC data
+#   dxf(polylines, arcs)                DXF data consists of closed shapes
+#
+# area is (left, bottom, right, top) in mm where coordinates are placed.
+
+import math, random
+
+def gerber(coords, apertures=10, macros=2, seed=0, area=(-100, -100, 100, 100)):
+    # macros are referred by apertures, so apertures must not be less than
+    # macros. coordinate blocks are mixture of aperture selection, moves,
+    # lines, arcs, flashes and regions
+    rand = random.Random(seed)
+    left, bottom, right, top = [int(value * 10000) for value in area]
+    lines = ['%MOMM*%\n', '%FSLAX34Y34*%\n']
+    for num in range(macros):
+        lines.append('%%AMMACRO%d*1,1,$1,0,0*21,1,$2,$3,0,0,%d*%%\n' % (num, num * 15 % 90))
+    shapes = ('C,%.2f', 'R,%.2fX0.5', 'O,%.2fX0.3', 'P,%.2fX6X15')
+    for num in range(apertures):
+        size = 0.1 + num * 0.05
+        if num < macros:
+            definition = 'MACRO%d,%.2fX%.2fX0.2' % (num, size, size * 2)
+        else:
+            definition = shapes[num % len(shapes)] % size
+        lines.append('%%ADD%d%s*%%\n' % (10 + num, definition))
+    lines.append('G75*\n%LPD*%\n')
+    for num in range(coords):
+        kind = num % 20
+        x = rand.randint(left, right)
+        y = rand.randint(bottom, top)
+        if kind == 0:
+            lines.append('D%d*\n' % (10 + rand.randrange(apertures)))
+        elif kind == 1 or kind == 11:
+            lines.append('X%dY%dD02*\n' % (x, y))
+        elif kind == 2:
+            lines.append('G03X%dY%dI%dJ%dD01*\n' % (x, y, x // 2, y // 2))
+        elif kind == 3 or kind == 13:
+            lines.append('X%dY%dD03*\n' % (x, y))
+        elif kind == 10:
+            size = rand.randint(1000, max(1000, min(50000, right - x, top - y)))
+            lines.append('G36*\nX%dY%dD02*\nG01X%dY%dD01*\nX%dY%dD01*\nX%dY%dD01*\nG37*\n' % (
+                x, y, x + size, y, x + size, y + size, x, y))
+        else:
+            lines.append('G01X%dY%dD01*\n' % (x, y))
+    lines.append('M02*\n')
+    return ''.join(lines)
+
+def excellon(hits, routs=0, tools=10, seed=0, area=(0, 0, 99, 99)):
+    # hits and routs are distributed to tools evenly, routs are placed after
+    # all hits. a rout occupies 2mm square from its start point
+    rand = random.Random(seed)
+    left, bottom, right, top = [int(value * 10000) for value in area]
+    lines = ['M48\n', ';FILE_FORMAT=2:4\n', 'METRIC,TZ\n']
+    for tool in range(1, tools + 1):
+        lines.append('T%02dC%.3f\n' % (tool, 0.3 + tool * 0.05))
+    lines.append('%\nG90\n')
+    def point(margin=0):
+        return rand.randint(left, right - margin), rand.randint(bottom, top - margin)
+    for tool in range(1, tools + 1):
+        lines.append('T%02d\n' % tool)
+        for num in range(hits // tools + (1 if tool <= hits % tools else 0)):
+            lines.append('X%dY%d\n' % point())
+    for tool in range(1, tools + 1):
+        count = routs // tools + (1 if tool <= routs % tools else 0)
+        if count:
+            lines.append('T%02d\n' % tool)
+        for num in range(count):
+            x, y = point(20000)
+            lines.append('G00X%dY%d\nM15\nG01X%dY%d\nG02X%dY%dI0J%d\nM16\nG05\n' % (
+                x, y, x + 20000, y, x + 20000, y + 20000, 10000))
+    lines.append('M30\n')
+    return ''.join(lines)
+
+def dxf(polylines, arcs, seed=0):
+    # shapes are placed in a grid of 10mm cells. a cell has a closed
+    # rectangle made of a polyline if its index is less than polylines, and
+    # a slot made of lines and arcs inside the rectangle if its index is
+    # less than arcs. entities of slots are shuffled, so that they have to
+    # be connected into paths
+    rand = random.Random(seed)
+    cells = max(polylines, arcs)
+    columns = max(1, int(math.ceil(math.sqrt(cells))))
+    entities = []
+    for num in range(cells):
+        left, bottom = num % columns * 10., num // columns * 10.
+        if num < polylines:
+            points = ((left + 1, bottom + 1), (left + 9, bottom + 1),
+                      (left + 9, bottom + 9), (left + 1, bottom + 9))
+            entities.append(_dxf_polyline(points))
+        if num < arcs:
+            y = bottom + 5
+            entities.append(_dxf_line((left + 3, y - 1), (left + 7, y - 1)))
+            entities.append(_dxf_arc((left + 7, y), 1, 270, 90))
+            entities.append(_dxf_line((left + 7, y + 1), (left + 3, y + 1)))
+            entities.append(_dxf_arc((left + 3, y), 1, 90, 270))
+    rand.shuffle(entities)
+    return ''.join(['0\nSECTION\n2\nHEADER\n9\n$INSUNITS\n70\n4\n0\nENDSEC\n',
+                    '0\nSECTION\n2\nENTITIES\n'] + entities + ['0\nENDSEC\n0\nEOF\n'])
+
+def _dxf_polyline(points):
+    text = '0\nLWPOLYLINE\n8\n0\n90\n%d\n70\n1\n' % len(points)
+    return text + ''.join('10\n%f\n20\n%f\n' % point for point in points)
+
+def _dxf_line(start, end):
+    return '0\nLINE\n8\n0\n10\n%f\n20\n%f\n11\n%f\n21\n%f\n' % (start + end)
+
+def _dxf_arc(center, radius, start_angle, end_angle):
+    return '0\nARC\n8\n0\n10\n%f\n20\n%f\n40\n%f\n50\n%f\n51\n%f\n' % (
+        center + (radius, start_angle, end_angle))
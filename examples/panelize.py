@@ -2,7 +2,7 @@
 
 import sys, os
 import gerberex
-from gerberex import DxfFile, GerberComposition, DrillComposition
+from gerberex import DxfFile, GerberComposition, MergeJob, PanelBuilder
 
 exts = ['GTL', 'GTO', 'GTP', 'GTS', 'GBL', 'GBO', 'GBP', 'GBS', 'TXT']
 boards=[
@@ -20,53 +20,51 @@ outline =    'inputs/outline.dxf'
 mousebites = 'inputs/mousebites.dxf'
 outputs =    'outputs/panelized'
 
-os.chdir(os.path.dirname(__file__))
-try:
-    os.mkdir('outputs')
-except FileExistsError:
-    pass
-
 def putstr(text):
     sys.stdout.write(text)
     sys.stdout.flush()
 
-for ext in exts:
-    putstr('merging %s: ' % ext)
-    if ext == 'TXT':
-        ctx = DrillComposition()
-    else:
-        ctx = GerberComposition()
+def main():
+    os.chdir(os.path.dirname(__file__))
+    try:
+        os.mkdir('outputs')
+    except FileExistsError:
+        pass
+
+    board_files = {}
+    placements = []
     for path, x_offset, y_offset, angle in boards:
-        file = gerberex.read(path + ext)
-        file.to_metric()
-        file.rotate(angle)
-        file.offset(x_offset, y_offset)
-        ctx.merge(file)
-        putstr('.')
-    if ext == 'TXT':
-        file = gerberex.read(mousebites)
-        file.draw_mode = DxfFile.DM_MOUSE_BITES
-        file.to_metric()
-        file.width = 0.5
-        file.format = (3, 3)
-        ctx.merge(file)
-    else:
-        file = gerberex.read(outline)
-        ctx.merge(file)
-    ctx.dump(outputs + '.' + ext)
-    putstr(' end\n')
+        board_files[path] = dict((ext, path + ext) for ext in exts)
+        placements.append((path, x_offset, y_offset, angle))
+    mousebites_job = MergeJob(mousebites, units='metric', attributes={
+        'draw_mode': DxfFile.DM_MOUSE_BITES, 'width': 0.5, 'format': (3, 3)})
+    extras = dict((ext, [mousebites_job if ext == 'TXT' else MergeJob(outline)]) for ext in exts)
+
+    putstr('merging layers: ')
+    builder = PanelBuilder(board_files, placements, extras)
+    timings = builder.build(lambda ext: outputs + '.' + ext)
+    putstr('end\n')
+    for ext in exts:
+        putstr('  %s: %.2f sec\n' % (ext, timings[ext]))
+
+    outline_file = gerberex.read(outline)
+
+    putstr('generating GML: ')
+    file = outline_file.clone()
+    file.write(outputs + '.GML')
+    putstr('.')
+    ctx = GerberComposition()
+    base = gerberex.rectangle(width=100, height=100, left=0, bottom=0, units='metric')
+    base.draw_mode = DxfFile.DM_FILL
+    ctx.merge(base)
+    file.draw_mode = DxfFile.DM_FILL
+    file.negate_polarity()
+    ctx.merge(file)
+    ctx.dump(outputs + '-fill.GML')
 
-putstr('generating GML: ')
-file = gerberex.read(outline)
-file.write(outputs + '.GML')
-putstr('.')
-ctx = GerberComposition()
-base = gerberex.rectangle(width=100, height=100, left=0, bottom=0, units='metric')
-base.draw_mode = DxfFile.DM_FILL
-ctx.merge(base)
-file.draw_mode = DxfFile.DM_FILL
-file.negate_polarity()
-ctx.merge(file)
-ctx.dump(outputs + '-fill.GML')
+    putstr('. end\n')
 
-putstr('. end\n')
+# worker processes of PanelBuilder may import this module again when they
+# are spawned, so panels are built only when it runs as a script
+if __name__ == '__main__':
+    main()
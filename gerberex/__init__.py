@@ -10,6 +10,11 @@ gerber-tools-extension is a extention package for gerber-tools.
 This package provide panelizing of PCB fucntion.
 """
 
+__version__ = '0.9.3'
+
 from gerberex.common import read, loads, rectangle
-from gerberex.composition import GerberComposition, DrillComposition
+from gerberex.rs274x import iter_gerber
+from gerberex.composition import GerberComposition, DrillComposition, MergeJob
+from gerberex.panel import PanelBuilder
 from gerberex.dxf import DxfFile
+from gerberex.cache import FileCache
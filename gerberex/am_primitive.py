@@ -9,6 +9,11 @@ from gerber.am_eval import OpCode
 
 from gerberex.am_expression import eval_macro, AMConstantExpression, AMOperatorExpression
 
+def _negate(expression):
+    if isinstance(expression, AMConstantExpression):
+        return AMConstantExpression(0 - expression.value)
+    return AMOperatorExpression(AMOperatorExpression.SUB, AMConstantExpression(0), expression)
+
 class AMPrimitiveDef(AMPrimitive):
     def __init__(self, code, exposure=None, rotation=None):
         super(AMPrimitiveDef, self).__init__(code, exposure)
@@ -22,6 +27,16 @@ class AMPrimitiveDef(AMPrimitive):
                                              AMConstantExpression(float(angle)))
         self.rotation = self.rotation.optimize()
 
+    def mirror(self, x=True, y=False):
+        # mirroring x is equivalent to mirroring y and rotating by 180 degrees
+        if x != y:
+            self._mirror_y()
+        if x:
+            self.rotate(180)
+
+    def _mirror_y(self):
+        self.rotation = _negate(self.rotation)
+
     def to_inch(self):
         pass
     
@@ -43,6 +58,9 @@ class AMCommentPrimitiveDef(AMPrimitiveDef):
         super(AMCommentPrimitiveDef, self).__init__(code)
         self.comment = comment
     
+    def _mirror_y(self):
+        pass
+
     def to_gerber(self, settings=None):
         return '%d %s*' % (self.code, self.comment.to_gerber())
     
@@ -65,6 +83,10 @@ class AMCirclePrimitiveDef(AMPrimitiveDef):
         self.center_x = center_x
         self.center_y = center_y
 
+    def _mirror_y(self):
+        super(AMCirclePrimitiveDef, self)._mirror_y()
+        self.center_y = _negate(self.center_y)
+
     def to_inch(self):
         self.diameter = self.diameter.to_inch().optimize()
         self.center_x = self.center_x.to_inch().optimize()
@@ -112,6 +134,11 @@ class AMVectorLinePrimitiveDef(AMPrimitiveDef):
         self.end_x = end_x
         self.end_y = end_y
 
+    def _mirror_y(self):
+        super(AMVectorLinePrimitiveDef, self)._mirror_y()
+        self.start_y = _negate(self.start_y)
+        self.end_y = _negate(self.end_y)
+
     def to_inch(self):
         self.width = self.width.to_inch().optimize()
         self.start_x = self.start_x.to_inch().optimize()
@@ -164,6 +191,10 @@ class AMCenterLinePrimitiveDef(AMPrimitiveDef):
         self.x = x
         self.y = y
 
+    def _mirror_y(self):
+        super(AMCenterLinePrimitiveDef, self)._mirror_y()
+        self.y = _negate(self.y)
+
     def to_inch(self):
         self.width = self.width.to_inch().optimize()
         self.height = self.height.to_inch().optimize()
@@ -208,6 +239,10 @@ class AMOutlinePrimitiveDef(AMPrimitiveDef):
         super(AMOutlinePrimitiveDef, self).__init__(code, exposure, rotation)
         self.addrs = addrs
 
+    def _mirror_y(self):
+        super(AMOutlinePrimitiveDef, self)._mirror_y()
+        self.addrs = [_negate(a) if i % 2 else a for i, a in enumerate(self.addrs)]
+
     def to_inch(self):
         self.addrs = [i.to_inch().optimize() for i in self.addrs]
     
@@ -254,6 +289,10 @@ class AMPolygonPrimitiveDef(AMPrimitiveDef):
         self.y = y
         self.diameter = diameter
 
+    def _mirror_y(self):
+        super(AMPolygonPrimitiveDef, self)._mirror_y()
+        self.y = _negate(self.y)
+
     def to_inch(self):
         self.x = self.x.to_inch().optimize()
         self.y = self.y.to_inch().optimize()
@@ -310,6 +349,10 @@ class AMMoirePrimitiveDef(AMPrimitiveDef):
         self.crosshair_thickness = crosshair_thickness
         self.crosshair_length = crosshair_length
 
+    def _mirror_y(self):
+        super(AMMoirePrimitiveDef, self)._mirror_y()
+        self.y = _negate(self.y)
+
     def to_inch(self):
         self.x = self.x.to_inch().optimize()
         self.y = self.y.to_inch().optimize()
@@ -373,6 +416,10 @@ class AMThermalPrimitiveDef(AMPrimitiveDef):
         self.inner_diameter = inner_diameter
         self.gap = gap
 
+    def _mirror_y(self):
+        super(AMThermalPrimitiveDef, self)._mirror_y()
+        self.y = _negate(self.y)
+
     def to_inch(self):
         self.x = self.x.to_inch().optimize()
         self.y = self.y.to_inch().optimize()
@@ -428,6 +475,9 @@ class AMVariableDef(object):
     def rotate(self, angle, center=None):
         pass
 
+    def mirror(self, x=True, y=False):
+        pass
+
 def to_primitive_defs(instructions):
     classes = {
         0: AMCommentPrimitiveDef,
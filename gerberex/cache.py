@@ -0,0 +1,85 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# Copyright 2019 Hiroshi Murayama <opiopan@gmail.com>
+
+import os
+import hashlib
+import pickle
+import tempfile
+import gerberex
+from gerberex.utility import ENCODING
+
+class FileCache(object):
+    # persistent cache of loaded files, each entry is keyed by hash of file
+    # content, gerberex version and loading options.
+    # least recently used entries are evicted when total size exceeds max_size
+    SUFFIX = '.pickle'
+    DEFAULT_MAX_SIZE = 512 * 1024 * 1024
+
+    def __init__(self, directory, max_size=DEFAULT_MAX_SIZE):
+        self.directory = directory
+        self.max_size = max_size
+        os.makedirs(directory, exist_ok=True)
+
+    def key(self, data, *options):
+        if isinstance(data, str):
+            data = data.encode(ENCODING)
+        digest = hashlib.sha256(data)
+        digest.update(repr((gerberex.__version__,) + options).encode())
+        return digest.hexdigest()
+
+    def load(self, key):
+        path = self._path(key)
+        try:
+            with open(path, 'rb') as f:
+                file = pickle.load(f)
+        except (OSError, EOFError, pickle.UnpicklingError):
+            return None
+        try:
+            os.utime(path)
+        except OSError:
+            # entry may be evicted by another process in the meantime
+            pass
+        return file
+
+    def store(self, key, file):
+        fd, tmpname = tempfile.mkstemp(suffix='.tmp', dir=self.directory)
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                pickle.dump(file, f, pickle.HIGHEST_PROTOCOL)
+            os.replace(tmpname, self._path(key))
+        except:
+            os.remove(tmpname)
+            raise
+        self.evict()
+
+    def evict(self):
+        entries = []
+        total = 0
+        for name in os.listdir(self.directory):
+            if not name.endswith(self.SUFFIX):
+                continue
+            try:
+                stat = os.stat(os.path.join(self.directory, name))
+            except OSError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, name))
+            total += stat.st_size
+        entries.sort()
+        for mtime, size, name in entries:
+            if total <= self.max_size:
+                break
+            try:
+                os.remove(os.path.join(self.directory, name))
+            except OSError:
+                pass
+            total -= size
+
+    def clear(self):
+        for name in os.listdir(self.directory):
+            if name.endswith(self.SUFFIX):
+                os.remove(os.path.join(self.directory, name))
+
+    def _path(self, key):
+        return os.path.join(self.directory, key + self.SUFFIX)
@@ -0,0 +1,64 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# Copyright 2019 Hiroshi Murayama <opiopan@gmail.com>
+
+import os
+import sys
+import json
+import argparse
+from gerberex.panel import PanelBuilder, build_panels
+import gerberex.instrument as instrument
+
+try:
+    import tomllib
+except ImportError:
+    tomllib = None
+
+def load_spec(path):
+    # panel spec is JSON, or TOML if file name ends with .toml
+    if path.lower().endswith('.toml'):
+        if tomllib is None:
+            raise Exception('tomllib is required to read TOML spec: %s' % path)
+        with open(path, 'rb') as f:
+            return tomllib.load(f)
+    with open(path, 'r') as f:
+        return json.load(f)
+
+def panelize(paths, workers=None, cache=None):
+    # builds panels of all specs in one worker pool.
+    # returns list of (spec path, timings)
+    panels = []
+    for path in paths:
+        panels.append(PanelBuilder.from_spec(
+            load_spec(path), os.path.dirname(path), workers, cache))
+    return list(zip(paths, build_panels(panels, workers)))
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        prog='gerberex-panelize',
+        description='build panels described in JSON or TOML spec files')
+    parser.add_argument('specs', nargs='+', metavar='SPEC', help='panel spec file')
+    parser.add_argument('-j', '--workers', type=int, default=None,
+                        help='number of worker processes (default: number of cores)')
+    parser.add_argument('-c', '--cache', default=None, metavar='DIR',
+                        help='directory to cache parsed source files')
+    parser.add_argument('-q', '--quiet', action='store_true', help='do not show timings')
+    parser.add_argument('--profile', default=None, metavar='REPORT',
+                        help='write per-phase profiling report as JSON')
+    args = parser.parse_args(argv)
+    if args.profile is None:
+        results = panelize(args.specs, args.workers, args.cache)
+    else:
+        with instrument.recording() as report:
+            results = panelize(args.specs, args.workers, args.cache)
+        report.dump(args.profile)
+    for path, timings in results:
+        if not args.quiet:
+            sys.stdout.write('%s: %.2f sec\n' % (path, sum(timings.values())))
+            for layer in timings:
+                sys.stdout.write('  %s: %.2f sec\n' % (layer, timings[layer]))
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,143 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# Copyright 2019 Hiroshi Murayama <opiopan@gmail.com>
+
+from gerber.gerber_statements import CoordStmt, ApertureStmt
+from gerberex.utility import value_formatter
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+# codes keep notation of each function and op, so they are written as is
+FUNCTIONS = (None, 'G01', 'G02', 'G03', 'G1', 'G2', 'G3')
+FUNCTION_CODES = dict((name, code) for code, name in enumerate(FUNCTIONS))
+OPS = (None, 'D01', 'D02', 'D03', 'D1', 'D2', 'D3')
+OP_CODES = dict((name, code) for code, name in enumerate(OPS))
+NO_DCODE = -1
+
+def is_available():
+    return numpy is not None
+
+class CoordColumns(object):
+    # columnar storage of CoordStmt in main statements of gerber data.
+    # x, y, i and j are float arrays which represent None as nan,
+    # function and op are codes of FUNCTIONS and OPS,
+    # dcode is aperture selected when each statement is drawn and
+    # index is position of each statement in the statement list.
+    # arrays are never modified in place, so they can be shared with clones
+    def __init__(self, index, function, x, y, i, j, op, dcode, is_original=False):
+        self.index = index
+        self.function = function
+        self.x = x
+        self.y = y
+        self.i = i
+        self.j = j
+        self.op = op
+        self.dcode = dcode
+        self.is_original = is_original
+
+    @classmethod
+    def from_statements(cls, statements):
+        if numpy is None:
+            raise Exception('numpy is required for columnar coordinates')
+        rows = []
+        append = rows.append
+        current = NO_DCODE
+        for num, statement in enumerate(statements):
+            if isinstance(statement, CoordStmt):
+                append((num, FUNCTION_CODES[statement.function], OP_CODES[statement.op],
+                        current, statement.x, statement.y, statement.i, statement.j))
+            elif isinstance(statement, ApertureStmt):
+                current = int(statement.d)
+        # None is converted to nan
+        rows = numpy.array(rows, dtype=float).reshape((len(rows), 8))
+        return cls(rows[:, 0].astype(numpy.intp), rows[:, 1].astype(numpy.int8),
+                   rows[:, 4].copy(), rows[:, 5].copy(), rows[:, 6].copy(), rows[:, 7].copy(),
+                   rows[:, 2].astype(numpy.int8), rows[:, 3].astype(numpy.int32), True)
+
+    def __len__(self):
+        return len(self.index)
+
+    def transformed(self, transform):
+        # same arithmetic as scalar transformation, so results are bit identical.
+        # a pair of coordinates is transformed only if both values are present
+        a, b, c, d, e, f = transform.matrix
+        x, y = _pair(self.x, self.y, a, b, c, d, e, f)
+        i, j = _pair(self.i, self.j, a, b, c, d, 0., 0.)
+        function = self.function
+        if transform.mirrored:
+            function = _ARC_MIRRORING[function]
+        return CoordColumns(self.index, function, x, y, i, j, self.op, self.dcode)
+
+    def apply(self, statements, units):
+        # write coordinates back to statement objects
+        for num, function, x, y, i, j in zip(
+                self.index.tolist(), self.function.tolist(), _values(self.x),
+                _values(self.y), _values(self.i), _values(self.j)):
+            statement = statements[num]
+            statement.x, statement.y, statement.i, statement.j = x, y, i, j
+            statement.function = FUNCTIONS[function]
+            statement.units = units
+
+    def to_gerber(self, settings):
+        # returns output lines which are same as CoordStmt.to_gerber()
+        format, zero_suppression = settings.format, settings.zero_suppression
+        functions = [name or '' for name in FUNCTIONS]
+        ops = [name or '' for name in OPS]
+        return [''.join(items) + '*' for items in zip(
+            [functions[code] for code in self.function.tolist()],
+            format_column(self.x, 'X', format, zero_suppression),
+            format_column(self.y, 'Y', format, zero_suppression),
+            format_column(self.i, 'I', format, zero_suppression),
+            format_column(self.j, 'J', format, zero_suppression),
+            [ops[code] for code in self.op.tolist()])]
+
+def format_column(column, prefix, format=(2, 5), zero_suppression='trailing'):
+    # formats whole column with same result as gerber.utils.write_gerber_value().
+    # values are scaled to integers at once, only values whose rounding is
+    # ambiguous in floating point are formatted by printf style conversion.
+    # nan is formatted as empty string, others are prefixed
+    format_value = value_formatter(format, zero_suppression)
+    integer_digits, decimal_digits = format
+    width = integer_digits + decimal_digits if decimal_digits > 0 else integer_digits + 1
+    present = ~numpy.isnan(column)
+    scaled = numpy.abs(numpy.where(present, column, 0.)) * 10. ** decimal_digits
+    rounded = numpy.rint(scaled)
+    exact = (numpy.abs(scaled - numpy.floor(scaled) - 0.5) > numpy.spacing(scaled)) & \
+        (scaled < 2. ** 52)
+    integers = numpy.where(exact, rounded, 0.).astype(numpy.int64).tolist()
+    negative = (prefix + '-').__add__
+    positive = prefix.__add__
+    result = []
+    for value, integer, is_present, is_exact in zip(
+            column.tolist(), integers, present.tolist(), exact.tolist()):
+        if not is_present:
+            result.append('')
+            continue
+        if not is_exact:
+            result.append(prefix + format_value(value))
+            continue
+        if integer == 0:
+            result.append(prefix + '0')
+            continue
+        digits = str(integer)
+        if zero_suppression == 'trailing':
+            digits = digits.zfill(width).rstrip('0')
+        elif zero_suppression != 'leading':
+            digits = digits.zfill(width)
+        result.append(negative(digits) if value < 0 else positive(digits))
+    return result
+
+if numpy is not None:
+    _ARC_MIRRORING = numpy.array((0, 1, 3, 2, 4, 3, 2), dtype=numpy.int8)
+
+def _pair(x, y, a, b, c, d, e, f):
+    present = ~(numpy.isnan(x) | numpy.isnan(y))
+    return (numpy.where(present, a * x + b * y + e, x),
+            numpy.where(present, c * x + d * y + f, y))
+
+def _values(column):
+    return [None if value != value else value for value in column.tolist()]
@@ -4,6 +4,8 @@
 # Copyright 2019 Hiroshi Murayama <opiopan@gmail.com>
 
 import os
+import re
+import mmap
 from gerber.common import loads as loads_org
 from gerber.exceptions import ParseError
 from gerber.utils import detect_file_format
@@ -12,25 +14,65 @@ import gerber.ipc356
 import gerberex.rs274x
 import gerberex.excellon
 import gerberex.dxf
+import gerberex.instrument as instrument
+from gerberex.utility import ENCODING
+from gerberex.cache import FileCache
 
-def read(filename, format=None):
-    with open(filename, 'rU') as f:
+MMAP_THRESHOLD = 16 * 1024 * 1024
+CACHEABLE_TYPES = (gerberex.rs274x.GerberFile, gerberex.excellon.ExcellonFileEx,
+                   gerberex.dxf.DxfFile)
+
+def read(filename, format=None, lean=False, cache=None):
+    with open(filename, 'rb') as f:
+        size = os.fstat(f.fileno()).st_size
+        if size >= MMAP_THRESHOLD:
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+                return loads(data, filename, format=format, lean=lean, cache=cache)
         data = f.read()
-    return loads(data, filename, format=format)
+    return loads(data, filename, format=format, lean=lean, cache=cache)
+
+
+def loads(data, filename=None, format=None, lean=False, cache=None):
+    if cache is None:
+        return _loads(data, filename, format, lean)
+
+    if not isinstance(cache, FileCache):
+        cache = FileCache(cache)
+    key = cache.key(data, _is_dxf(filename), format, lean)
+    with instrument.phase('cache.load'):
+        file = cache.load(key)
+    if file is None:
+        file = _loads(data, filename, format, lean)
+        if not isinstance(file, CACHEABLE_TYPES):
+            return file
+        cache.store(key, file)
+    file.filename = filename
+    return file
+
 
+def _loads(data, filename, format, lean):
+    with instrument.phase('parse'):
+        file = _parse(data, filename, format, lean)
+    if instrument.enabled():
+        instrument.count_statements(filename, _statements(file))
+    return file
 
-def loads(data, filename=None, format=None):
-    if os.path.splitext(filename if filename else '')[1].lower() == '.dxf':
+def _parse(data, filename, format, lean):
+    if _is_dxf(filename):
         return gerberex.dxf.loads(data, filename)
 
-    fmt = detect_file_format(data)
+    fmt = _detect_file_format(data)
     if fmt == 'rs274x':
+        if lean:
+            return gerberex.rs274x.loads_lean(data, filename=filename)
         file = gerberex.rs274x.loads(data, filename=filename)
         return gerberex.rs274x.GerberFile.from_gerber_file(file)
     elif fmt == 'excellon':
         return gerberex.excellon.loads(data, filename=filename, format=format)
     elif fmt == 'ipc_d_356':
-        return ipc356.loads(data, filename=filename)
+        if not isinstance(data, str):
+            data = str(data[:], ENCODING)
+        return gerber.ipc356.loads(data, filename=filename)
     else:
         raise ParseError('Unable to detect file format')
 
@@ -38,3 +80,29 @@ def loads(data, filename=None, format=None):
 def rectangle(width, height, left=0, bottom=0, units='metric', draw_mode=None, filename=None):
     return gerberex.dxf.DxfFile.rectangle(
         width, height, left, bottom, units, draw_mode, filename)
+
+def _statements(file):
+    if isinstance(file, gerberex.rs274x.GerberFile):
+        return list(file.aperture_macros.values()) + file.aperture_defs + file.main_statements
+    if isinstance(file, gerberex.dxf.DxfFile):
+        return file.statements.statements
+    return file.statements
+
+def _is_dxf(filename):
+    return os.path.splitext(filename if filename else '')[1].lower() == '.dxf'
+
+_LINE = re.compile(br'[^\r\n]+')
+
+def _detect_file_format(data):
+    if isinstance(data, str):
+        return detect_file_format(data)
+    for match in _LINE.finditer(data):
+        line = match.group()
+        if b'M48' in line:
+            return 'excellon'
+        elif b'%FS' in line:
+            return 'rs274x'
+        elif ((len(line.split()) >= 2) and
+              (line.split()[0] == b'P') and (line.split()[1] == b'JOB')):
+            return 'ipc_d_356'
+    return 'unknown'
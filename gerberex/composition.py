@@ -3,62 +3,146 @@
 
 # Copyright 2019 Hiroshi Murayama <opiopan@gmail.com>
 import os
-from functools import reduce
+import tempfile
+from concurrent.futures import ProcessPoolExecutor
 from gerber.cam import FileSettings
-from gerber.gerber_statements import EofStmt
+from gerber.gerber_statements import EofStmt, ApertureStmt
 from gerber.excellon_statements import *
 from gerber.excellon import DrillSlot, DrillHit
+import gerberex.common
 import gerberex.rs274x
 import gerberex.excellon
 import gerberex.dxf
+import gerberex.instrument as instrument
+from gerberex.utility import shallow_copy, ENCODING
 
 class Composition(object):
     def __init__(self, settings = None, comments = None):
         self.settings = settings
         self.comments = comments if comments != None else []
 
+    def merge_many(self, jobs, workers=None, cache=None):
+        # files are read and transformed in worker processes, then merged in
+        # order of jobs, so the result is same as merging them one by one.
+        # jobs: MergeJob objects or tuples of MergeJob arguments
+        # cache: FileCache or its directory to read files through
+        jobs = [job if isinstance(job, MergeJob) else MergeJob(*job) for job in jobs]
+        if workers == 1 or len(jobs) < 2:
+            for job in jobs:
+                self.merge(load_merge_job(job, cache))
+            return
+        with ProcessPoolExecutor(workers) as executor:
+            for file in executor.map(load_merge_job, jobs, [cache] * len(jobs)):
+                self.merge(file)
+
+class MergeJob(object):
+    # a file to be merged by merge_many(), it is converted to units, then
+    # attributes such as draw_mode or width are set, then it is rotated
+    # and moved
+    def __init__(self, path, x_offset=0, y_offset=0, angle=0, units=None, attributes=None):
+        self.path = path
+        self.x_offset = x_offset
+        self.y_offset = y_offset
+        self.angle = angle
+        self.units = units
+        self.attributes = attributes if attributes is not None else {}
+
+def load_merge_job(job, cache=None):
+    file = gerberex.common.read(job.path, lean=True, cache=cache)
+    if job.units == 'metric':
+        file.to_metric()
+    elif job.units == 'inch':
+        file.to_inch()
+    for name in job.attributes:
+        setattr(file, name, job.attributes[name])
+    file.rotate(job.angle)
+    file.offset(job.x_offset, job.y_offset)
+    # pending transformation is applied in worker process
+    if isinstance(file, gerberex.rs274x.GerberFile):
+        file.drawing_statements()
+    elif isinstance(file, gerberex.excellon.ExcellonFileEx):
+        file.hits
+        file.statements
+    elif isinstance(file, gerberex.dxf.DxfFile):
+        file.statements.open_paths
+    return file
+
 class GerberComposition(Composition):
     APERTURE_ID_BIAS = 10
+    STATEMENT_SIZE = 300
+    COPY_SIZE = 1024 * 1024
 
-    def __init__(self, settings=None, comments=None):
+    def __init__(self, settings=None, comments=None, memory_budget=None):
+        # memory_budget: approximate upper limit in bytes of drawing statements
+        # kept in memory, drawings exceeding it are written out to a temporary
+        # spill file. drawings are never spilled if None is specified
         super(GerberComposition, self).__init__(settings, comments)
         self.aperture_macros = {}
         self.apertures = []
         self.drawings = []
+        self.memory_budget = memory_budget
+        # source file name of each drawing
+        self._sources = []
+        # apertures and macros are shared among merged files if definitions
+        # are same, and only ones selected by drawings are written out
+        self._aperture_table = {}
+        self._macro_table = {}
+        self._used_apertures = set()
+        self._memory_usage = 0
+        self._spill = None
+        self._spill_format = None
 
     def merge(self, file):
-        if isinstance(file, gerberex.rs274x.GerberFile):
-            self._merge_gerber(file)
-        elif isinstance(file, gerberex.dxf.DxfFile):
-            self._merge_dxf(file)
-        else:
-            raise Exception('unsupported file type')
+        with instrument.phase('gerber.merge'):
+            if isinstance(file, gerberex.rs274x.GerberFile):
+                self._merge_gerber(file)
+            elif isinstance(file, gerberex.dxf.DxfFile):
+                self._merge_dxf(file)
+            else:
+                raise Exception('unsupported file type')
 
     def dump(self, path):
         def statements():
+            apertures = [s for s in self.apertures if s.d in self._used_apertures]
+            shapes = set(s.shape for s in apertures)
             for k in self.aperture_macros:
-                yield self.aperture_macros[k]
-            for s in self.apertures:
-                yield s
-            for s in self.drawings:
+                if k in shapes:
+                    yield self.aperture_macros[k]
+            for s in apertures:
                 yield s
-            yield EofStmt()
         self.settings.notation = 'absolute'
         self.settings.zeros = 'trailing'
-        with open(path, 'w') as f:
+        if self._spill is not None and self._spill_format != self._format():
+            raise Exception('output format cannot be changed after drawings are spilled')
+        with instrument.phase('gerber.dump'), open(path, 'w') as f:
             gerberex.rs274x.write_gerber_header(f, self.settings)
             for statement in statements():
                 f.write(statement.to_gerber(self.settings) + '\n')
+            for source, drawing in zip(self._sources, self.drawings):
+                if isinstance(drawing, SpilledDrawing):
+                    f.flush()
+                    self._copy_spilled(drawing, f.buffer)
+                    instrument.add_bytes(source, drawing.size)
+                else:
+                    self._write_drawing(f, drawing, source)
+            f.write(EofStmt().to_gerber(self.settings) + '\n')
+        if instrument.enabled():
+            instrument.add_output(path, os.path.getsize(path))
 
     def _merge_gerber(self, file):
         aperture_macro_map = {}
         aperture_map = {}
 
+        # statements are kept by reference, so that they are owned by a clone
+        # not to be affected by later transformation of the file
+        file = file.clone()
         if self.settings:
             if self.settings.units == 'metric':
                 file.to_metric()
             else:
                 file.to_inch()
+        else:
+            self.settings = shallow_copy(file.context)
 
         for macro in file.aperture_macros:
             statement = file.aperture_macros[macro]
@@ -68,87 +152,182 @@ class GerberComposition(Composition):
 
         for statement in file.aperture_defs:
             if statement.param == 'AD':
+                statement = shallow_copy(statement)
                 if statement.shape in aperture_macro_map:
                     statement.shape = aperture_macro_map[statement.shape]
                 dnum = statement.d
                 newdnum = self._register_aperture(statement)
                 aperture_map[dnum] = newdnum
 
-        for statement in file.main_statements:
-            if statement.type == 'APERTURE':
-                statement.d = aperture_map[statement.d]
-            self.drawings.append(statement)
-        
-        if not self.settings:
-            self.settings = file.context
+        statements, columns = file.drawing_statements()
+        self.drawings.append(GerberDrawing(statements, aperture_map, columns))
+        self._sources.append(file.filename)
+        self._used_apertures.update(
+            aperture_map[s.d] for s in statements
+            if isinstance(s, ApertureStmt) and s.d in aperture_map)
+        self._reserve(len(statements))
 
     def _merge_dxf(self, file):
+        file = file.clone()
         if self.settings:
             if self.settings.units == 'metric':
                 file.to_metric()
             else:
                 file.to_inch()
 
-        file.dcode = self._register_aperture(file.aperture)
-        self.drawings.append(file.statements)
-
         if not self.settings:
             self.settings = file.settings
 
+        dcode = self._register_aperture(file.aperture)
+        file.dcode = dcode
+        self._used_apertures.add(dcode)
+        self.drawings.append(file.statements)
+        self._sources.append(file.filename)
+        self._reserve(len(file.statements.statements))
+
+    def _reserve(self, num_statements):
+        self._memory_usage += num_statements * self.STATEMENT_SIZE
+        if self.memory_budget is None:
+            return
+        for index, drawing in enumerate(self.drawings):
+            if self._memory_usage <= self.memory_budget:
+                break
+            if not isinstance(drawing, SpilledDrawing):
+                self.drawings[index] = self._spill_drawing(drawing)
+
+    def _spill_drawing(self, drawing):
+        # drawing is written out with the settings at this time
+        self.settings.notation = 'absolute'
+        self.settings.zeros = 'trailing'
+        if self._spill is None:
+            self._spill = tempfile.TemporaryFile('w+', encoding=ENCODING)
+            self._spill_format = self._format()
+        elif self._spill_format != self._format():
+            raise Exception('output format cannot be changed after drawings are spilled')
+        self._spill.flush()
+        start = self._spill.buffer.seek(0, os.SEEK_END)
+        # spilled bytes are counted when they are copied to output
+        num_statements = self._write_drawing(self._spill, drawing, count=False)
+        self._spill.flush()
+        self._memory_usage -= num_statements * self.STATEMENT_SIZE
+        return SpilledDrawing(start, self._spill.buffer.tell() - start)
+
+    def _copy_spilled(self, drawing, out):
+        spill = self._spill.buffer
+        spill.seek(drawing.start)
+        remaining = drawing.size
+        while remaining > 0:
+            data = spill.read(min(remaining, self.COPY_SIZE))
+            out.write(data)
+            remaining -= len(data)
+
+    def _write_drawing(self, f, drawing, source=None, count=True):
+        if isinstance(drawing, GerberDrawing):
+            lines = (line + '\n' for line in drawing.lines(self.settings))
+            f.writelines(instrument.counted(source, lines) if count else lines)
+            return len(drawing.main_statements)
+        data = drawing.to_gerber(self.settings) + '\n'
+        f.write(data)
+        if count:
+            instrument.add_bytes(source, len(data))
+        return len(drawing.statements)
+
+    def _format(self):
+        return (self.settings.units, self.settings.format, self.settings.zero_suppression)
+
 
     def _register_aperture_macro(self, statement):
         name = statement.name
+        # primitives part of definition
+        key = (statement.units, statement.to_gerber(self.settings)[len(name) + 4:])
+        if key in self._macro_table:
+            return self._macro_table[key]
         newname = name
         offset = 0
         while newname in self.aperture_macros:
             offset += 1
             newname = '%s_%d' % (name, offset)
-        statement.name = newname
+        if newname != name:
+            statement = shallow_copy(statement)
+            statement.name = newname
         self.aperture_macros[newname] = statement
+        self._macro_table[key] = newname
         return newname
 
     def _register_aperture(self, statement):
+        # shape and modifiers part of definition
+        key = (getattr(statement, 'units', None),
+               statement.to_gerber(self.settings)[len('%%ADD%d' % statement.d):])
+        if key in self._aperture_table:
+            return self._aperture_table[key]
         statement.d = len(self.apertures) + self.APERTURE_ID_BIAS
         self.apertures.append(statement)
+        self._aperture_table[key] = statement.d
         return statement.d
 
+class GerberDrawing(object):
+    # drawing statements of a merged file,
+    # D-codes are remapped on output instead of rewriting the statements
+    def __init__(self, statements, aperture_map, columns=None):
+        self.main_statements = statements
+        self.aperture_map = aperture_map
+        self.columns = columns
+
+    def lines(self, settings):
+        return gerberex.rs274x.format_statements(
+            self.main_statements, settings, self.columns, self.aperture_map)
+
+class SpilledDrawing(object):
+    # drawing statements written out to spill file of composition
+    def __init__(self, start, size):
+        self.start = start
+        self.size = size
+
 class DrillComposition(Composition):
     def __init__(self, settings=None, comments=None):
         super(DrillComposition, self).__init__(settings, comments)
         self.tools = []
         self.hits = []
         self.dxf_statements = []
+        # hits and DXF statements are also grouped by tool number when merged,
+        # so that they can be written out in a single pass
+        self._hits_by_tool = {}
+        self._dxf_by_tool = {}
+        self._tool_table = {}
     
     def merge(self, file):
-        if isinstance(file, gerberex.excellon.ExcellonFileEx):
-            self._merge_excellon(file)
-        elif isinstance(file, gerberex.DxfFile):
-            self._merge_dxf(file)
-        else:
-            raise Exception('unsupported file type')
+        with instrument.phase('drill.merge'):
+            if isinstance(file, gerberex.excellon.ExcellonFileEx):
+                self._merge_excellon(file)
+            elif isinstance(file, gerberex.DxfFile):
+                self._merge_dxf(file)
+            else:
+                raise Exception('unsupported file type')
 
     def dump(self, path):
         def statements():
             for t in self.tools:
                 yield ToolSelectionStmt(t.number).to_excellon(self.settings)
-                for h in self.hits:
-                    if h.tool.number == t.number:
-                        yield h.to_excellon(self.settings)
-                for num, statement in self.dxf_statements:
-                    if num == t.number:
-                        yield statement.to_excellon(self.settings)
+                for h in self._hits_by_tool.get(t.number, ()):
+                    yield h.to_excellon(self.settings)
+                for statement in self._dxf_by_tool.get(t.number, ()):
+                    yield statement.to_excellon(self.settings)
             yield EndOfProgramStmt().to_excellon()
 
         self.settings.notation = 'absolute'
         self.settings.zeros = 'trailing'
-        with open(path, 'w') as f:
+        with instrument.phase('drill.dump'), open(path, 'w') as f:
             gerberex.excellon.write_excellon_header(f, self.settings, self.tools)
             for statement in statements():
                 f.write(statement + '\n')
+        if instrument.enabled():
+            instrument.add_output(path, os.path.getsize(path))
 
     def _merge_excellon(self, file):
         tool_map = {}
 
+        # hits are kept by reference, so that they are owned by a clone
+        file = file.clone()
         if not self.settings:
             self.settings = file.settings
         else:
@@ -160,12 +339,13 @@ class DrillComposition(Composition):
         for tool in iter(file.tools.values()):
             num = tool.number
             tool_map[num] = self._register_tool(tool)
-        
+
+        self.hits.append((tool_map, file.hits))
         for hit in file.hits:
-            hit.tool = tool_map[hit.tool.number]
-            self.hits.append(hit)
+            self._hits_by_tool.setdefault(tool_map[hit.tool.number].number, []).append(hit)
     
     def _merge_dxf(self, file):
+        file = file.clone()
         if not self.settings:
             self.settings = file.settings
         else:
@@ -176,17 +356,26 @@ class DrillComposition(Composition):
 
         tool = self._register_tool(ExcellonTool(self.settings, number=1, diameter=file.width))
         self.dxf_statements.append((tool.number, file.statements))
+        self._dxf_by_tool.setdefault(tool.number, []).append(file.statements)
 
     def _register_tool(self, tool):
-        for existing in self.tools:
-            if existing.equivalent(tool):
-                return existing
+        key = self._tool_key(tool)
+        if key in self._tool_table:
+            return self._tool_table[key]
         new_tool = ExcellonTool.from_tool(tool)
         new_tool.settings = self.settings
-        def toolnums():
-            for tool in self.tools:
-                yield tool.number
-        max_num = reduce(lambda x, y: x if x > y else y, toolnums(), 0)
-        new_tool.number = max_num + 1
+        # tools are numbered in order of registration
+        new_tool.number = self.tools[-1].number + 1 if self.tools else 1
         self.tools.append(new_tool)
+        self._tool_table[key] = new_tool
         return new_tool
+
+    def _tool_key(self, tool):
+        # same as ExcellonTool.equivalent() except that diameter is quantized
+        # to output precision, tools written out as same size are unified
+        diameter = tool.diameter
+        if diameter is not None:
+            diameter = int(round(diameter * 10 ** self.settings.format[1]))
+        return (type(tool), diameter, tool.feed_rate, tool.retract_rate, tool.rpm,
+                tool.depth_offset, tool.max_hit_count, tool.plated,
+                tool.settings.units if tool.settings else None)
@@ -4,17 +4,20 @@
 # Copyright 2019 Hiroshi Murayama <opiopan@gmail.com>
 
 import io, sys
+import copy
 from math import pi, cos, sin, tan, atan, atan2, acos, asin, sqrt
 import dxfgrabber
 from gerber.cam import CamFile, FileSettings
-from gerber.utils import inch, metric, write_gerber_value, rotate_point
+from gerber.utils import inch, metric, write_gerber_value, rotate_point, MILLIMETERS_PER_INCH
 from gerber.gerber_statements import ADParamStmt
 from gerber.excellon_statements import ExcellonTool
 from gerber.excellon_statements import CoordinateStmt
-from gerberex.utility import is_equal_point, is_equal_value
-from gerberex.dxf_path import generate_paths, judge_containment
+from gerberex.utility import is_equal_point, is_equal_value, shallow_copy, Transform, ENCODING
+from gerberex.dxf_path import generate_paths, judge_containment, colliding_pairs
 from gerberex.excellon import write_excellon_header
 from gerberex.rs274x import write_gerber_header
+from gerberex.columns import numpy
+import gerberex.instrument as instrument
 
 ACCEPTABLE_ERROR = 0.001
 
@@ -73,7 +76,7 @@ def _intersections_of_line_and_circle(start, end, center, radius, error_range):
 
     p1_angle = atan2(p1_y, p1_x)
     p2_angle = atan2(p2_y, p2_x)
-    if dx == 0: 
+    if abs(dx) < abs(dy):
         p1_t = (p1_y - y1) / dy
         p2_t = (p2_y - y1) / dy
     else:
@@ -95,6 +98,19 @@ def _intersections_of_line_and_circle(start, end, center, radius, error_range):
             p1_t, p2_t
         )
 
+def _accumulate(start, step, limit=None, count=None):
+    # start, start + step, start + step + step, ... while less than limit,
+    # or count values. sums are same as adding step repeatedly in loop
+    if count is None:
+        count = max(int((limit - start) / step), 0) + 2
+    steps = numpy.full(count, float(step))
+    if count:
+        steps[0] = start
+    values = numpy.cumsum(steps)
+    if limit is not None:
+        values = values[:numpy.searchsorted(values, limit)]
+    return values
+
 class DxfStatement(object):
     def __init__(self, entity):
         self.entity = entity
@@ -120,6 +136,9 @@ class DxfStatement(object):
     def rotate(self, angle, center=(0, 0)):
         raise Exception('Not supported')
 
+    def transform(self, transform):
+        raise Exception('Not supported')
+
 
 class DxfLineStatement(DxfStatement):
     @classmethod
@@ -187,6 +206,28 @@ class DxfLineStatement(DxfStatement):
                 y0 += yd
                 d += pitch
 
+    def dot_columns(self, pitch, width, offset=0):
+        # same dots as dots() computed at once, requires numpy.
+        # returns arrays of x, y and remaining length of each dot.
+        # if no dot is placed, x and y are None and offset is returned as is
+        # since dots() yields nothing in that case
+        x0, y0 = self.start
+        x1, y1 = self.end
+        xp = x1 - x0
+        yp = y1 - y0
+        l = sqrt(xp * xp + yp * yp)
+        if offset > l + width / 2:
+            return (None, None, offset)
+        xd = xp * pitch / l
+        yd = yp * pitch / l
+        x0 += xp * offset / l
+        y0 += yp * offset / l
+
+        # values are accumulated in same order as dots()
+        d = _accumulate(offset, pitch, l + width / 2)
+        count = len(d)
+        return (_accumulate(x0, xd, count=count), _accumulate(y0, yd, count=count), d - l)
+
     def offset(self, offset_x, offset_y):
         self.start = (self.start[0] + offset_x, self.start[1] + offset_y)
         self.end = (self.end[0] + offset_x, self.end[1] + offset_y)
@@ -194,6 +235,10 @@ class DxfLineStatement(DxfStatement):
     def rotate(self, angle, center=(0, 0)):
         self.start = rotate_point(self.start, angle, center)
         self.end = rotate_point(self.end, angle, center)
+
+    def transform(self, transform):
+        self.start = transform.point(*self.start)
+        self.end = transform.point(*self.end)
     
     def intersections_with_halfline(self, point_from, point_to, error_range):
         denominator = (self.end[0] - self.start[0]) * (point_to[1] - point_from[1]) - \
@@ -330,6 +375,28 @@ class DxfArcStatement(DxfStatement):
                 yield((x, y), remain)
                 da += pangle
 
+    def dot_columns(self, pitch, width, offset=0):
+        # same dots as dots() computed at once, requires numpy.
+        # returns arrays of x, y and remaining length of each dot.
+        # if no dot is placed, x and y are None and remaining length of
+        # offset is returned
+        angle = self.end_angle - self.start_angle
+        afactor = 1 if angle > 0 else -1
+        aangle = angle * afactor
+        L = 2 * pi * self.radius
+        l = L * aangle / 360
+        pangle = pitch / L * 360
+        wangle = width / L * 360
+        oangle = offset / L * 360
+
+        if offset > l + width / 2:
+            return (None, None, offset - l)
+        da = _accumulate(oangle, pangle, aangle + wangle / 2)
+        cangle = (self.start_angle + da * afactor) / 180 * pi
+        return (self.radius * numpy.cos(cangle) + self.center[0],
+                self.radius * numpy.sin(cangle) + self.center[1],
+                (da - aangle) / 360 * L)
+
     def offset(self, offset_x, offset_y):
         self.center = (self.center[0] + offset_x, self.center[1] + offset_y)
         self.start = (self.start[0] + offset_x, self.start[1] + offset_y)
@@ -343,6 +410,16 @@ class DxfArcStatement(DxfStatement):
         self.end = rotate_point(self.end, angle, center)
         self.angle_regions = _normalize_angle(self.start_angle, self.end_angle)
 
+    def transform(self, transform):
+        self.radius *= transform.scale
+        self.center = transform.point(*self.center)
+        self.start = transform.point(*self.start)
+        self.end = transform.point(*self.end)
+        if transform.angle != 0 or transform.mirrored:
+            self.start_angle = transform.direction(self.start_angle)
+            self.end_angle = transform.direction(self.end_angle)
+            self.angle_regions = _normalize_angle(self.start_angle, self.end_angle)
+
     def intersections_with_halfline(self, point_from, point_to, error_range):
         intersection = \
             _intersections_of_line_and_circle(
@@ -427,6 +504,11 @@ class DxfArcStatement(DxfStatement):
                 break
         return pts
 
+class _Entity(object):
+    # minimal substitute of dxfgrabber entity, defined at module level
+    # to keep statements picklable
+    pass
+
 class DxfPolylineStatement(DxfStatement):
     def __init__(self, entity):
         super(DxfPolylineStatement, self).__init__(entity)
@@ -438,9 +520,6 @@ class DxfPolylineStatement(DxfStatement):
             self.end = (self.entity.points[-1][0], self.entity.points[-1][1])
 
     def disassemble(self):
-        class Item:
-            pass
-
         def ptseq():
             for i in range(1, len(self.entity.points)):
                 yield i
@@ -455,7 +534,7 @@ class DxfPolylineStatement(DxfStatement):
             x1 = pt[0]
             y1 = pt[1]
             if b == 0:
-                item = Item()
+                item = _Entity()
                 item.dxftype = 'LINE'
                 item.start = (x0, y0)
                 item.end = (x1, y1)
@@ -476,7 +555,7 @@ class DxfPolylineStatement(DxfStatement):
                 start_angle *= 180 / pi
                 end_angle = start_angle + ang * 180 / pi
 
-                item = Item()
+                item = _Entity()
                 item.dxftype = 'ARC'
                 item.start = (x0, y0)
                 item.end = (x1, y1)
@@ -515,6 +594,9 @@ class DxfPolylineStatement(DxfStatement):
             self.entity.points[idx] = rotate_point(self.entity.points[idx], angle, center)
 
 class DxfStatements(object):
+    _shared = False
+    _transform = Transform()
+
     def __init__(self, statements, units, dcode=10, draw_mode=None, fill_mode=None):
         if draw_mode is None:
             draw_mode = DxfFile.DM_LINE
@@ -532,7 +614,9 @@ class DxfStatements(object):
                           is_equal_point(i.start, i.end, self.error_range)),
             statements
         ))
-        self.close_paths, self.open_paths = generate_paths(self.statements, self.error_range)
+        with instrument.phase('dxf.generate_paths'):
+            self._close_paths, self._open_paths = \
+                generate_paths(self.statements, self.error_range)
         self.sorted_close_paths = []
         self.polarity = True # True means dark, False means clear
 
@@ -540,6 +624,30 @@ class DxfStatements(object):
     def units(self):
         return _units
 
+    def clone(self):
+        # entities and paths are shared until either object is transformed
+        clone = shallow_copy(self)
+        self._shared = clone._shared = True
+        return clone
+
+    def _own(self):
+        if self._shared:
+            self.statements, self._open_paths, self._close_paths, self.sorted_close_paths = \
+                copy.deepcopy((self.statements, self._open_paths, self._close_paths,
+                               self.sorted_close_paths))
+            self._shared = False
+
+    @property
+    def open_paths(self):
+        # paths are transformed lazily when they are referred
+        self._apply_transform()
+        return self._open_paths
+
+    @property
+    def close_paths(self):
+        self._apply_transform()
+        return self._close_paths
+
     def _polarity_command(self, polarity=None):
         if polarity is None:
             polarity = self.polarity
@@ -548,13 +656,17 @@ class DxfStatements(object):
     def _prepare_sorted_close_paths(self):
         if self.sorted_close_paths:
             return
-        for i in range(0, len(self.close_paths)):
-            for j in range(i + 1, len(self.close_paths)):
+        with instrument.phase('dxf.prepare_sorted_close_paths'):
+            for path in self.close_paths:
+                path.containers = []
+            # only paths whose bounding boxes overlap can contain each other
+            for i, j in colliding_pairs(self.close_paths):
                 containee, container = judge_containment(
                     self.close_paths[i], self.close_paths[j], self.error_range)
                 if containee is not None:
                     containee.containers.append(container)
-        self.sorted_close_paths = sorted(self.close_paths, key=lambda path: len(path.containers))
+            self.sorted_close_paths = sorted(self.close_paths,
+                                             key=lambda path: len(path.containers))
 
     def to_gerber(self, settings=FileSettings()):
         def gerbers():
@@ -605,10 +717,7 @@ class DxfStatements(object):
             self.pitch = inch(self.pitch)
             self.width = inch(self.width)
             self.error_range = inch(self.error_range)
-            for path in self.open_paths:
-                path.to_inch()
-            for path in self.close_paths:
-                path.to_inch()
+            self._transform = self._transform.scaled(1. / MILLIMETERS_PER_INCH)
 
     def to_metric(self):
         if self._units == 'inch':
@@ -616,22 +725,28 @@ class DxfStatements(object):
             self.pitch = metric(self.pitch)
             self.width = metric(self.width)
             self.error_range = metric(self.error_range)
-            for path in self.open_paths:
-                path.to_metric()
-            for path in self.close_paths:
-                path.to_metric()
+            self._transform = self._transform.scaled(MILLIMETERS_PER_INCH)
     
     def offset(self, offset_x, offset_y):
-        for path in self.open_paths:
-            path.offset(offset_x, offset_y)
-        for path in self.close_paths:
-            path.offset(offset_x, offset_y)
+        self._transform = self._transform.translated(offset_x, offset_y)
 
     def rotate(self, angle, center=(0, 0)):
-        for path in self.open_paths:
-            path.rotate(angle, center)
-        for path in self.close_paths:
-            path.rotate(angle, center)
+        self._transform = self._transform.rotated(angle, center)
+
+    def mirror(self, x=True, y=False, center=(0, 0)):
+        self._transform = self._transform.mirrored_by(x, y, center)
+
+    def _apply_transform(self):
+        transform = self._transform
+        if transform.is_identity:
+            return
+        self._own()
+        with instrument.phase('dxf.transform'):
+            for path in self._open_paths:
+                path.transform(transform)
+            for path in self._close_paths:
+                path.transform(transform)
+        self._transform = Transform()
 
 class DxfFile(CamFile):
     DM_LINE = 0
@@ -701,7 +816,14 @@ class DxfFile(CamFile):
         else:
             self.aperture.to_metric()
         self.statements = DxfStatements(
-            statements, self.units, dcode=self.aperture.d, draw_mode=self.draw_mode, fill_mode=self.filename)
+            statements, self.units, dcode=self.aperture.d, draw_mode=self.draw_mode, fill_mode=self._fill_mode)
+
+    def clone(self):
+        # geometry is shared until either file is transformed
+        clone = shallow_copy(self)
+        clone.aperture = copy.deepcopy(self.aperture)
+        clone.statements = self.statements.clone()
+        return clone
 
     @property
     def dcode(self):
@@ -785,12 +907,18 @@ class DxfFile(CamFile):
     def rotate(self, angle, center=(0, 0)):
         self.statements.rotate(angle, center)
 
+    def mirror(self, x=True, y=False, center=(0, 0)):
+        # x: negate x coordinates, y: negate y coordinates
+        self.statements.mirror(x, y, center)
+
     def negate_polarity(self):
         self.statements.polarity = not self.statements.polarity
 
 def loads(data, filename=None):
+    if not isinstance(data, str):
+        data = str(data[:], ENCODING)
     if sys.version_info.major == 2:
         data = unicode(data)
     stream = io.StringIO(data)
     dxf = dxfgrabber.read(stream)
-    return DxfFile.from_dxf(dxf)
+    return DxfFile.from_dxf(dxf, filename=filename)
@@ -3,12 +3,18 @@
 
 # Copyright 2019 Hiroshi Murayama <opiopan@gmail.com>
 
-from gerber.utils import inch, metric, write_gerber_value
+from math import floor, ceil, acos, cos, sin, sqrt, hypot, pi
+from gerber.utils import inch, metric
 from gerber.cam import FileSettings
-from gerberex.utility import is_equal_point, is_equal_value, normalize_vec2d, dot_vec2d
+from gerberex.utility import is_equal_point, is_equal_value, normalize_vec2d, dot_vec2d, \
+    value_formatter
 from gerberex.excellon import CoordinateStmtEx
+from gerberex.columns import numpy, format_column, is_available as is_columns_available
 
 class DxfPath(object):
+    # flattened polygon for containment query, built when it's required
+    _edge_table = None
+
     def __init__(self, statements, error_range=0):
         self.statements = statements
         self.error_range = error_range
@@ -59,23 +65,36 @@ class DxfPath(object):
             return False
 
     def to_inch(self):
+        self._edge_table = None
         self.error_range = inch(self.error_range)
         for statement in self.statements:
             statement.to_inch()
 
     def to_metric(self):
+        self._edge_table = None
         self.error_range = metric(self.error_range)
         for statement in self.statements:
             statement.to_metric()
 
     def offset(self, offset_x, offset_y):
+        self._edge_table = None
         for statement in self.statements:
             statement.offset(offset_x, offset_y)
 
     def rotate(self, angle, center=(0, 0)):
+        self._edge_table = None
         for statement in self.statements:
             statement.rotate(angle, center)
 
+    def transform(self, transform):
+        self._edge_table = None
+        self.error_range *= transform.scale
+        for statement in self.statements:
+            statement.transform(transform)
+        self.bounding_box = self.statements[0].bounding_box
+        for statement in self.statements[1:]:
+            self._merge_bounding_box(statement.bounding_box)
+
     def reverse(self):
         rlist = []
         for statement in reversed(self.statements):
@@ -88,6 +107,7 @@ class DxfPath(object):
             return False
         if not error_range:
             error_range = self.error_range
+        self._edge_table = None
         if is_equal_point(self.end, element.start, error_range):
             return self._append_at_end(element, error_range)
         elif is_equal_point(self.end, element.end, error_range):
@@ -175,49 +195,35 @@ class DxfPath(object):
         else:
             return True
 
+    def edge_table(self, error_range=0):
+        table = self._edge_table
+        if table is None or table.error_range != error_range:
+            table = self._edge_table = _EdgeTable(self, error_range)
+        return table
+
     def to_gerber(self, settings=FileSettings(), pitch=0, width=0):
         from gerberex.dxf import DxfArcStatement
+        format_value = value_formatter(settings.format, settings.zero_suppression)
         if pitch == 0:
             x0, y0 = self.statements[0].start
-            gerber = 'G01*\nX{0}Y{1}D02*\nG75*'.format(
-                write_gerber_value(x0, settings.format,
-                                   settings.zero_suppression),
-                write_gerber_value(y0, settings.format,
-                                   settings.zero_suppression),
-            )
+            lines = ['G01*\nX{0}Y{1}D02*\nG75*'.format(
+                format_value(x0), format_value(y0))]
 
             for statement in self.statements:
                 x0, y0 = statement.start
                 x1, y1 = statement.end
                 if isinstance(statement, DxfArcStatement):
                     xc, yc = statement.center
-                    gerber += '\nG{0}*\nX{1}Y{2}I{3}J{4}D01*'.format(
+                    lines.append('G{0}*\nX{1}Y{2}I{3}J{4}D01*'.format(
                         '03' if statement.end_angle > statement.start_angle else '02',
-                        write_gerber_value(x1, settings.format,
-                                           settings.zero_suppression),
-                        write_gerber_value(y1, settings.format,
-                                           settings.zero_suppression),
-                        write_gerber_value(xc - x0, settings.format,
-                                           settings.zero_suppression),
-                        write_gerber_value(yc - y0, settings.format,
-                                           settings.zero_suppression)
-                    )
+                        format_value(x1), format_value(y1),
+                        format_value(xc - x0), format_value(yc - y0)))
                 else:
-                    gerber += '\nG01*\nX{0}Y{1}D01*'.format(
-                        write_gerber_value(x1, settings.format,
-                                           settings.zero_suppression),
-                        write_gerber_value(y1, settings.format,
-                                           settings.zero_suppression),
-                    )
+                    lines.append('G01*\nX{0}Y{1}D01*'.format(
+                        format_value(x1), format_value(y1)))
+            gerber = '\n'.join(lines)
         else:
-            def ploter(x, y):
-                return 'X{0}Y{1}D03*\n'.format(
-                    write_gerber_value(x, settings.format,
-                                       settings.zero_suppression),
-                    write_gerber_value(y, settings.format,
-                                          settings.zero_suppression),
-                )
-            gerber = self._plot_dots(pitch, width, ploter)
+            gerber = self._plot_dots(pitch, width, settings, 'D03*\n')
 
         return gerber
 
@@ -243,14 +249,55 @@ class DxfPath(object):
             
             excellon += 'M16\nG05\n'
         else:
-            def ploter(x, y):
-                return CoordinateStmtEx(x=x, y=y).to_excellon(settings) + '\n'
-            excellon = self._plot_dots(pitch, width, ploter)
+            excellon = self._plot_dots(pitch, width, settings, '\n')
 
         return excellon
 
-    def _plot_dots(self, pitch, width, ploter):
-        out = ''
+    def _plot_dots(self, pitch, width, settings, terminator):
+        # each dot is written as coordinates followed by terminator
+        x, y = self.dots(pitch, width)
+        if is_columns_available():
+            x = format_column(x, 'X', settings.format, settings.zero_suppression)
+            y = format_column(y, 'Y', settings.format, settings.zero_suppression)
+        else:
+            format_value = value_formatter(settings.format, settings.zero_suppression)
+            x = ['X' + format_value(value) for value in x]
+            y = ['Y' + format_value(value) for value in y]
+        return ''.join([xy[0] + xy[1] + terminator for xy in zip(x, y)])
+
+    def dots(self, pitch, width):
+        # positions of mouse bites along the path, returns x and y as arrays
+        # if numpy is available, otherwise as lists.
+        # a dot beyond end of statement is placed on next statement, and
+        # the last statement of open path may have it up to half of width
+        if not is_columns_available():
+            return self._scalar_dots(pitch, width)
+        xs, ys = [], []
+        offset = 0
+        for idx in range(0, len(self.statements)):
+            statement = self.statements[idx]
+            if offset < 0:
+                offset += pitch
+            x, y, remain = statement.dot_columns(pitch, width, offset)
+            if x is None:
+                offset = remain
+                continue
+            count = len(remain)
+            if count == 0:
+                continue
+            if statement.is_closed or idx != len(self.statements) - 1:
+                count = numpy.searchsorted(remain, 0, 'right')
+                offset = float(remain[min(count, len(remain) - 1)])
+            else:
+                offset = float(remain[-1])
+            xs.append(x[:count])
+            ys.append(y[:count])
+        if not xs:
+            return (numpy.empty(0), numpy.empty(0))
+        return (numpy.concatenate(xs), numpy.concatenate(ys))
+
+    def _scalar_dots(self, pitch, width):
+        xs, ys = [], []
         offset = 0
         for idx in range(0, len(self.statements)):
             statement = self.statements[idx]
@@ -261,10 +308,9 @@ class DxfPath(object):
                     break
                 if offset > 0 and (statement.is_closed or idx != len(self.statements) - 1):
                     break
-                #if idx == len(self.statements) - 1 and statement.is_closed and offset > -pitch:
-                #    break
-                out += ploter(dot[0], dot[1])
-        return out
+                xs.append(dot[0])
+                ys.append(dot[1])
+        return (xs, ys)
 
     def intersections_with_halfline(self, point_from, point_to, error_range=0):
         def calculator(statement):
@@ -325,35 +371,48 @@ def generate_paths(statements, error_range=0):
     from gerberex.dxf import DxfPolylineStatement
 
     paths = []
+    # polylines are compared exactly as DxfPath.contain() does
+    polyline_units = _StatementIndex(0)
     for statement in filter(lambda s: isinstance(s, DxfPolylineStatement), statements):
         units = [unit for unit in statement.disassemble()]
         paths.append(DxfPath(units, error_range))
+        for unit in units:
+            polyline_units.add(unit)
 
+    # duplicated statements are removed, candidates are looked up by hash
+    # and confirmed by is_equal_to()
     unique_statements = []
+    unique_index = _StatementIndex(error_range)
     redundant = 0
     for statement in filter(lambda s: not isinstance(s, DxfPolylineStatement), statements):
-        for path in paths:
-            if path.contain(statement):
-                redundant += 1
-                break
+        if any(unit.is_equal_to(statement) for unit in polyline_units.candidates(statement)) or \
+           any(statement.is_equal_to(target, error_range)
+               for target in unique_index.candidates(statement)):
+            redundant += 1
         else:
-            for target in unique_statements:
-                if statement.is_equal_to(target, error_range):
-                    redundant += 1
-                    break
-            else:
-                unique_statements.append(statement)
+            unique_statements.append(statement)
+            unique_index.add(statement)
 
     paths.extend([DxfPath([s], error_range) for s in unique_statements])
 
+    # each path is merged into the first following path which accepts it.
+    # only paths having an end point near by are tried, they are looked up
+    # in the index in same order as whole list is scanned
     prev_paths_num = 0
     while prev_paths_num != len(paths):
+        index = _EndpointIndex(error_range)
+        for num, path in enumerate(paths):
+            index.add(num, path)
         working = []
         for i in range(len(paths)):
             mergee = paths[i]
-            for j in range(i + 1, len(paths)):
+            index.remove(i)
+            for j in index.candidates(mergee):
                 target = paths[j]
-                if target.merge(mergee, error_range):
+                index.remove(j)
+                merged = target.merge(mergee, error_range)
+                index.add(j, target)
+                if merged:
                     break
             else:
                 working.append(mergee)
@@ -364,6 +423,118 @@ def generate_paths(statements, error_range=0):
     open_path = list(filter(lambda p: not p.is_closed, paths))
     return (closed_path, open_path)
 
+def _cell_size(error_range):
+    # values regarded as same by is_equal_value() are in same or adjacent
+    # cells, margin absorbs rounding error of division.
+    # values are used as keys as is if error_range is 0
+    return error_range * (1 + 1e-6)
+
+def _quantize(value, cell):
+    return int(floor(value / cell)) if cell else value
+
+def _neighbors(value, cell):
+    if not cell:
+        return (value,)
+    key = _quantize(value, cell)
+    return (key - 1, key, key + 1)
+
+class _EndpointIndex(object):
+    # hash grid of end points of open paths
+    def __init__(self, error_range):
+        self.cell = _cell_size(error_range)
+        self.grid = {}
+        self.keys = {}
+
+    def add(self, num, path):
+        if path.is_closed:
+            return
+        # both end points may be in same cell
+        keys = set((self._key(path.start), self._key(path.end)))
+        self.keys[num] = keys
+        for key in keys:
+            self.grid.setdefault(key, set()).add(num)
+
+    def remove(self, num):
+        for key in self.keys.pop(num, ()):
+            entries = self.grid[key]
+            entries.discard(num)
+            if not entries:
+                del self.grid[key]
+
+    def candidates(self, path):
+        # indexes of paths which may be connected to the path in ascending order
+        if path.is_closed:
+            return []
+        found = set()
+        for point in (path.start, path.end):
+            for x in _neighbors(point[0], self.cell):
+                for y in _neighbors(point[1], self.cell):
+                    found.update(self.grid.get((x, y), ()))
+        return sorted(found)
+
+    def _key(self, point):
+        return (_quantize(point[0], self.cell), _quantize(point[1], self.cell))
+
+class _StatementIndex(object):
+    # hash grid of line and arc statements, keys are direction independent.
+    # lines are registered by both end points and arcs are registered by
+    # center and radius, statements equal to a statement within error_range
+    # are in adjacent cells of its start point or center
+    def __init__(self, error_range):
+        self.cell = _cell_size(error_range)
+        self.grid = {}
+
+    def add(self, statement):
+        from gerberex.dxf import DxfArcStatement, DxfLineStatement
+
+        cell = self.cell
+        if isinstance(statement, DxfLineStatement):
+            keys = set((_quantize(point[0], cell), _quantize(point[1], cell))
+                       for point in (statement.start, statement.end))
+        elif isinstance(statement, DxfArcStatement):
+            keys = [(_quantize(statement.center[0], cell), _quantize(statement.center[1], cell),
+                     _quantize(statement.radius, cell))]
+        else:
+            return
+        for key in keys:
+            self.grid.setdefault(key, []).append(statement)
+
+    def candidates(self, statement):
+        from gerberex.dxf import DxfArcStatement, DxfLineStatement
+
+        cell = self.cell
+        if isinstance(statement, DxfLineStatement):
+            keys = [(x, y) for x in _neighbors(statement.start[0], cell)
+                    for y in _neighbors(statement.start[1], cell)]
+        elif isinstance(statement, DxfArcStatement):
+            keys = [(x, y, r) for x in _neighbors(statement.center[0], cell)
+                    for y in _neighbors(statement.center[1], cell)
+                    for r in _neighbors(statement.radius, cell)]
+        else:
+            return []
+        found = []
+        for key in keys:
+            found.extend(self.grid.get(key, ()))
+        return found
+
+def colliding_pairs(paths):
+    # returns pairs of indexes (i, j) such as i < j in ascending order, whose
+    # bounding boxes may be in collision. pairs are found by sweeping paths
+    # in order of left edge of bounding boxes
+    order = sorted(range(len(paths)), key=lambda num: paths[num].bounding_box[0])
+    active = []
+    pairs = []
+    for num in order:
+        path = paths[num]
+        left = path.bounding_box[0]
+        active = [other for other in active if paths[other].bounding_box[2] > left]
+        for other in active:
+            if path.may_be_in_collision(paths[other]):
+                pairs.append((other, num) if other < num else (num, other))
+        active.append(num)
+    pairs.sort()
+    return pairs
+
 def judge_containment(path1, path2, error_range=0):
     from gerberex.dxf import DxfArcStatement, DxfLineStatement
 
@@ -372,21 +543,38 @@ def judge_containment(path1, path2, error_range=0):
         return nocontainment
     
     def is_in_line_segment(point_from, point_to, point):
+        # ratio is measured along longer axis, since nearly vertical or
+        # horizontal segment makes it inaccurate along the other one
         dx = point_to[0] - point_from[0]
-        ratio = (point[0] - point_from[0]) / dx if dx != 0 else \
-                (point[1] - point_from[1]) / (point_to[1] - point_from[1])
+        dy = point_to[1] - point_from[1]
+        ratio = (point[0] - point_from[0]) / dx if abs(dx) >= abs(dy) else \
+                (point[1] - point_from[1]) / dy
         return ratio >= 0 and ratio <= 1
 
-    def contain_in_path(statement, path):
+    def segment_of(statement):
         if isinstance(statement, DxfLineStatement):
-            segment = (statement.start, statement.end)
+            return (statement.start, statement.end)
         elif isinstance(statement, DxfArcStatement):
             if statement.start == statement.end:
-                segment = (statement.start, statement.center)
+                return (statement.start, statement.center)
             else:
-                segment = (statement.start, statement.end)
+                return (statement.start, statement.end)
         else:
             raise Exception('invalid dxf statement type')
+
+    def contain_in_table(statement, table):
+        # same judgement as contain_in_path() by the flattened path.
+        # None is returned if statement is too close to the path to judge
+        segment = segment_of(statement)
+        if not table.is_clear(segment[0], segment[1]):
+            return None
+        if isinstance(statement, DxfArcStatement) and \
+           not table.is_clear_of_circle(statement.center, statement.radius):
+            return None
+        return table.contains(segment[0])
+
+    def contain_in_path(statement, path):
+        segment = segment_of(statement)
         pts = path.intersections_with_halfline(segment[0], segment[1], error_range)
         if len(pts) % 2 == 0:
             return False
@@ -399,14 +587,174 @@ def judge_containment(path1, path2, error_range=0):
             if len(pts) > 0:
                 return False
         return True
+
+    def contain(statement, path):
+        if path.is_closed and len(path.statements) >= _EDGE_TABLE_STATEMENTS:
+            result = contain_in_table(statement, path.edge_table(error_range))
+            if result is not None:
+                return result
+        return contain_in_path(statement, path)
     
-    if contain_in_path(path1.statements[0], path2):
+    if contain(path1.statements[0], path2):
         containment = [path1, path2]
-    elif contain_in_path(path2.statements[0], path1):
+    elif contain(path2.statements[0], path1):
         containment = [path2, path1]
     else:
         return nocontainment
     for i in range(1, len(containment[0].statements)):
-        if not contain_in_path(containment[0].statements[i], containment[1]):
+        if not contain(containment[0].statements[i], containment[1]):
             return nocontainment
     return containment
+
+# edge table is used for paths having this number of statements at least,
+# since it doesn't pay for small paths
+_EDGE_TABLE_STATEMENTS = 16
+# lower limit of flattening tolerance relative to size of path
+_FLATTENING_RATIO = 1e-4
+# number of consecutive edges in a leaf of edge table
+_EDGE_BUCKET = 8
+
+class _EdgeTable(object):
+    # closed path flattened into a polygon, arcs are replaced with chords
+    # within tolerance. consecutive edges are grouped into buckets and
+    # bounding boxes of buckets are kept in a binary tree, so that edges
+    # around a point or a line segment are looked up by descending only
+    # into boxes which overlap the query.
+    # an answer is reliable only if the query is farther than margin from
+    # the polygon, since the polygon differs from the path by tolerance and
+    # intersection tests of the path accept error range
+    def __init__(self, path, error_range=0):
+        left, bottom, right, top = path.bounding_box
+        self.error_range = error_range
+        self.tolerance = max(error_range, max(right - left, top - bottom) * _FLATTENING_RATIO)
+        self.margin = (self.tolerance + error_range) * 4
+        # end point of each statement is same as start point of next one
+        # within error range, it's dropped to keep the polygon closed
+        points = []
+        for statement in path.statements:
+            points.extend(_flatten(statement, self.tolerance)[:-1])
+        self.edges = [points[i - 1] + points[i] for i in range(len(points))]
+        # node n has children 2n and 2n + 1, leaves follow inner nodes and
+        # leaf n holds bucket n - self.leaves
+        buckets = (len(self.edges) + _EDGE_BUCKET - 1) // _EDGE_BUCKET
+        self.leaves = 1
+        while self.leaves < buckets:
+            self.leaves *= 2
+        self.boxes = [None] * (self.leaves * 2)
+        for num in range(buckets):
+            edges = self.edges[num * _EDGE_BUCKET:(num + 1) * _EDGE_BUCKET]
+            self.boxes[self.leaves + num] = (
+                min(min(edge[0], edge[2]) for edge in edges),
+                min(min(edge[1], edge[3]) for edge in edges),
+                max(max(edge[0], edge[2]) for edge in edges),
+                max(max(edge[1], edge[3]) for edge in edges))
+        for node in range(self.leaves - 1, 0, -1):
+            first, second = self.boxes[node * 2], self.boxes[node * 2 + 1]
+            if first is None or second is None:
+                self.boxes[node] = first or second
+            else:
+                self.boxes[node] = (min(first[0], second[0]), min(first[1], second[1]),
+                                    max(first[2], second[2]), max(first[3], second[3]))
+
+    def contains(self, point):
+        # crossing number of the half-line toward +x direction
+        x, y = point
+        inside = False
+        for x0, y0, x1, y1 in self._edges_in(x, y, float('inf'), y):
+            if (y0 > y) != (y1 > y) and x0 + (y - y0) * (x1 - x0) / (y1 - y0) > x:
+                inside = not inside
+        return inside
+
+    def is_clear(self, start, end):
+        # whether line segment is farther than margin from all edges
+        for a, b in self._edges_around(min(start[0], end[0]), min(start[1], end[1]),
+                                       max(start[0], end[0]), max(start[1], end[1])):
+            if _segment_distance(start, end, a, b) <= self.margin:
+                return False
+        return True
+
+    def is_clear_of_circle(self, center, radius):
+        # whether whole circle is farther than margin from all edges
+        margin = self.margin
+        for a, b in self._edges_around(center[0] - radius, center[1] - radius,
+                                       center[0] + radius, center[1] + radius):
+            farthest = max(hypot(a[0] - center[0], a[1] - center[1]),
+                           hypot(b[0] - center[0], b[1] - center[1]))
+            if farthest >= radius - margin and _point_distance(center, a, b) <= radius + margin:
+                return False
+        return True
+
+    def _edges_around(self, left, bottom, right, top):
+        # edges which may be within margin from the box
+        margin = self.margin
+        for x0, y0, x1, y1 in self._edges_in(left - margin, bottom - margin,
+                                             right + margin, top + margin):
+            yield (x0, y0), (x1, y1)
+
+    def _edges_in(self, left, bottom, right, top):
+        # edges whose bounding box overlaps the box
+        for first, last in self._buckets_in(left, bottom, right, top):
+            for edge in self.edges[first:last]:
+                x0, y0, x1, y1 = edge
+                if max(x0, x1) < left or min(x0, x1) > right or \
+                   max(y0, y1) < bottom or min(y0, y1) > top:
+                    continue
+                yield edge
+
+    def _buckets_in(self, left, bottom, right, top):
+        # ranges of edge numbers of buckets whose bounding box overlaps the box
+        boxes = self.boxes
+        leaves = self.leaves
+        nodes = [1]
+        while nodes:
+            node = nodes.pop()
+            box = boxes[node]
+            if box is None or box[2] < left or box[0] > right or \
+               box[3] < bottom or box[1] > top:
+                continue
+            if node < leaves:
+                nodes.append(node * 2 + 1)
+                nodes.append(node * 2)
+            else:
+                first = (node - leaves) * _EDGE_BUCKET
+                yield first, first + _EDGE_BUCKET
+
+def _flatten(statement, tolerance):
+    # points from start to end of statement, arcs are divided into chords
+    # whose sagitta doesn't exceed tolerance
+    from gerberex.dxf import DxfArcStatement
+
+    if not isinstance(statement, DxfArcStatement):
+        return [statement.start, statement.end]
+    sweep = statement.end_angle - statement.start_angle
+    radius = statement.radius
+    step = min(2 * acos(max(1 - tolerance / radius, -1)) * 180 / pi, 90) \
+           if radius > 0 else 90
+    count = max(1, int(ceil(abs(sweep) / step))) if step > 0 else 1
+    points = [statement.start]
+    for num in range(1, count):
+        angle = (statement.start_angle + sweep * num / count) * pi / 180
+        points.append((statement.center[0] + radius * cos(angle),
+                       statement.center[1] + radius * sin(angle)))
+    points.append(statement.end)
+    return points
+
+def _segment_distance(a, b, c, d):
+    # distance between line segments a-b and c-d
+    def cross(o, p, q):
+        return (p[0] - o[0]) * (q[1] - o[1]) - (p[1] - o[1]) * (q[0] - o[0])
+    if cross(a, b, c) * cross(a, b, d) < 0 and cross(c, d, a) * cross(c, d, b) < 0:
+        return 0
+    return min(_point_distance(a, c, d), _point_distance(b, c, d),
+               _point_distance(c, a, b), _point_distance(d, a, b))
+
+def _point_distance(p, a, b):
+    # distance between point p and line segment a-b
+    dx = b[0] - a[0]
+    dy = b[1] - a[1]
+    length = dx * dx + dy * dy
+    t = ((p[0] - a[0]) * dx + (p[1] - a[1]) * dy) / length if length > 0 else 0
+    t = min(max(t, 0), 1)
+    x = a[0] + dx * t - p[0]
+    y = a[1] + dy * t - p[1]
+    return sqrt(x * x + y * y)
@@ -3,29 +3,103 @@
 
 # Copyright 2019 Hiroshi Murayama <opiopan@gmail.com>
 
+import math
 import operator
+import re
+import copy
 
 import gerber.excellon
-from gerber.excellon import ExcellonParser, detect_excellon_format, ExcellonFile, DrillHit, DrillSlot
+from gerber.excellon import ExcellonParser, ExcellonFile, DrillHit, DrillSlot, _layer_size_score
 from gerber.excellon_statements import ExcellonStatement, UnitStmt, CoordinateStmt, UnknownStmt, \
                                        SlotStmt, DrillModeStmt, RouteModeStmt, LinearModeStmt, \
                                        ToolSelectionStmt, ZAxisRoutPositionStmt, \
                                        RetractWithClampingStmt, RetractWithoutClampingStmt, \
-                                       EndOfProgramStmt
+                                       EndOfProgramStmt, CommentStmt
 from gerber.cam import FileSettings
-from gerber.utils import inch, metric, write_gerber_value, parse_gerber_value
-from gerberex.utility import rotate
+from gerber.utils import inch, metric, write_gerber_value, parse_gerber_value, MILLIMETERS_PER_INCH
+from gerberex.utility import rotate, shallow_copy, Transform, ENCODING
+import gerberex.instrument as instrument
 
 def loads(data, filename=None, settings=None, tools=None, format=None):
     if not settings:
-        settings = FileSettings(**detect_excellon_format(data))
+        settings = FileSettings(**_detect_excellon_format(data))
         if format:
             settings.format = format
-    gerber.excellon.CoordinateStmt = CoordinateStmtEx
-    gerber.excellon.UnitStmt = UnitStmtEx
-    file = ExcellonParser(settings, tools).parse_raw(data, filename)
+    parser = ExcellonParserEx(settings, tools)
+    for line in _lines(data):
+        parser._parse_line(line.strip())
+    for stmt in parser.statements:
+        stmt.units = parser.units
+    file = ExcellonFile(parser.statements, parser.tools, parser.hits,
+                        parser._settings(), filename)
     return ExcellonFileEx.from_file(file)
 
+_STR_LINE = re.compile(r'[^\r\n]+')
+_BYTES_LINE = re.compile(br'[^\r\n]+')
+
+def _lines(data):
+    if isinstance(data, str):
+        for match in _STR_LINE.finditer(data):
+            yield match.group()
+    else:
+        for match in _BYTES_LINE.finditer(data):
+            yield str(match.group(), ENCODING)
+
+def _detect_excellon_format(data):
+    # clues in header are enough in most cases,
+    # whole data is decoded for brute force detection only if those are missing
+    parser = ExcellonParserEx()
+    for line in _lines(data):
+        parser._parse_line(line.strip())
+        if parser.state == 'DRILL':
+            break
+    format, zeros = _format_clues(parser.statements)
+    if format is not None and zeros is not None:
+        return {'format': format, 'zeros': zeros}
+    if not isinstance(data, str):
+        data = str(data[:], ENCODING)
+    return _detect_excellon_format_by_trial(data)
+
+def _format_clues(statements):
+    zeros = [stmt.zeros for stmt in statements if isinstance(stmt, UnitStmt)]
+    formats = [stmt.comment for stmt in statements
+               if isinstance(stmt, CommentStmt) and 'FILE_FORMAT' in stmt.comment]
+    return (tuple([int(val) for val in formats[0].split('=')[1].split(':')])
+            if len(formats) == 1 else None,
+            zeros[0] if len(zeros) == 1 else None)
+
+def _detect_excellon_format_by_trial(data):
+    # same heuristics as detect_excellon_format() of pcb-tools,
+    # data is parsed by ExcellonParserEx to understand arc coordinates
+    parser = ExcellonParserEx()
+    parser.parse_raw(data)
+    format, zeros = _format_clues(parser.statements)
+    if format is not None and zeros is not None:
+        return {'format': format, 'zeros': zeros}
+    results = {}
+    for zeros_option in (zeros,) if zeros is not None else ('leading', 'trailing'):
+        for format_option in (format,) if format is not None else ((2, 4), (2, 5), (3, 3)):
+            try:
+                parser = ExcellonParserEx(FileSettings(zeros=zeros_option, format=format_option))
+                file = parser.parse_raw(data)
+                size = tuple([t[0] - t[1] for t in file.bounding_box])
+                hole_area = sum([math.pow(math.pi * hit.tool.diameter / 2., 2)
+                                 for hit in parser.hits])
+                results[(format_option, zeros_option)] = (size, parser.hole_count, hole_area)
+            except Exception:
+                pass
+    formats = set([key[0] for key in results])
+    zeros_set = set([key[1] for key in results])
+    format = formats.pop() if len(formats) == 1 else format
+    zeros = zeros_set.pop() if len(zeros_set) == 1 else zeros
+    if format is not None and zeros is not None:
+        return {'format': format, 'zeros': zeros}
+    scores = dict([(key, _layer_size_score(*results[key])) for key in results])
+    minscore = min(scores.values())
+    for key in scores:
+        if scores[key] == minscore:
+            return {'format': key[0], 'zeros': key[1]}
+
 def write_excellon_header(file, settings, tools):
     file.write('M48\nFMAT,2\nICI,OFF\n%s\n' %
                UnitStmtEx(settings.units, settings.zeros, settings.format).to_excellon(settings))
@@ -33,6 +107,13 @@ def write_excellon_header(file, settings, tools):
         file.write(tool.to_excellon(settings) + '\n')
     file.write('%%\nG90\n%s\n' % ('M72' if settings.units == 'inch' else 'M71'))
 
+def group_hits(hits):
+    # returns lists of hits for each tool number, order of hits is kept
+    groups = {}
+    for hit in hits:
+        groups.setdefault(hit.tool.number, []).append(hit)
+    return groups
+
 class ExcellonFileEx(ExcellonFile):
     @classmethod
     def from_file(cls, file):
@@ -170,34 +251,108 @@ class ExcellonFileEx(ExcellonFile):
     def primitives(self):
         return []
 
+    _shared = False
+    _transform = Transform()
+    _statement_ops = ()
+
     def __init__(self, statements, tools, hits, settings, filename=None):
         super(ExcellonFileEx, self).__init__(statements, tools, hits, settings, filename)
 
+    def clone(self):
+        # statements, tools and hits are shared until either file is modified
+        clone = shallow_copy(self)
+        self._shared = clone._shared = True
+        return clone
+
+    def _own(self):
+        if not self._shared:
+            return
+        memo = {}
+        self.tools = copy.deepcopy(self.tools, memo)
+        self._statements = [memo[id(s)] if id(s) in memo else shallow_copy(s)
+                            for s in self._statements]
+        def copy_hit(hit):
+            new = shallow_copy(hit)
+            new.tool = memo.get(id(hit.tool), hit.tool)
+            if isinstance(hit, DrillRout):
+                new.nodes = [shallow_copy(node) for node in hit.nodes]
+            return new
+        self._hits = [copy_hit(hit) for hit in self._hits]
+        self._shared = False
+
+    @property
+    def statements(self):
+        # unit conversion and offset of statements are applied lazily
+        self._apply_statement_ops()
+        return self._statements
+
+    @statements.setter
+    def statements(self, statements):
+        self._statements = statements
+        self._statement_ops = ()
+
+    @property
+    def hits(self):
+        # coordinates of hits are transformed lazily when hits are referred
+        self._apply_transform()
+        return self._hits
+
+    @hits.setter
+    def hits(self, hits):
+        self._hits = hits
+        self._transform = Transform()
+
+    def offset(self, x_offset=0, y_offset=0):
+        self._transform = self._transform.translated(x_offset, y_offset)
+        self._statement_ops += (('offset', x_offset, y_offset),)
+
     def rotate(self, angle, center=(0,0)):
         if angle % 360 == 0:
             return
-        for hit in self.hits:
-            hit.rotate(angle, center)
-    
+        self._transform = self._transform.rotated(angle, center)
+
+    def mirror(self, x=True, y=False, center=(0, 0)):
+        # x: negate x coordinates such as bottom layers seen from top side
+        # y: negate y coordinates
+        self._transform = self._transform.mirrored_by(x, y, center)
+
     def to_inch(self):
         if self.units == 'metric':
-            for stmt in self.statements:
-                stmt.to_inch()
+            self._own()
             for tool in self.tools:
                 self.tools[tool].to_inch()
-            for hit in self.hits:
-                hit.to_inch()
+            self._transform = self._transform.scaled(1. / MILLIMETERS_PER_INCH)
+            self._statement_ops += (('to_inch',),)
             self.units = 'inch'
 
     def to_metric(self):
         if self.units == 'inch':
-            for stmt in self.statements:
-                stmt.to_metric()
+            self._own()
             for tool in self.tools:
                 self.tools[tool].to_metric()
-            for hit in self.hits:
-                hit.to_metric()
+            self._transform = self._transform.scaled(MILLIMETERS_PER_INCH)
+            self._statement_ops += (('to_metric',),)
             self.units = 'metric'
+
+    def _apply_transform(self):
+        transform = self._transform
+        if transform.is_identity:
+            return
+        self._own()
+        with instrument.phase('excellon.transform'):
+            for hit in self._hits:
+                hit.transform(transform)
+        self._transform = Transform()
+
+    def _apply_statement_ops(self):
+        operations = self._statement_ops
+        if not operations:
+            return
+        self._own()
+        for stmt in self._statements:
+            for operation in operations:
+                getattr(stmt, operation[0])(*operation[1:])
+        self._statement_ops = ()
     
     def write(self, filename=None):
         self.notation = 'absolute'
@@ -205,12 +360,12 @@ class ExcellonFileEx(ExcellonFile):
         filename = filename if filename is not None else self.filename
         with open(filename, 'w') as f:
             write_excellon_header(f, self.settings, [self.tools[t] for t in self.tools])
+            hits = group_hits(self.hits)
             for tool in iter(self.tools.values()):
                 f.write(ToolSelectionStmt(
                     tool.number).to_excellon(self.settings) + '\n')
-                for hit in self.hits:
-                    if hit.tool.number == tool.number:
-                        f.write(hit.to_excellon(self.settings) + '\n')
+                f.writelines(hit.to_excellon(self.settings) + '\n'
+                             for hit in hits.get(tool.number, ()))
             f.write(EndOfProgramStmt().to_excellon() + '\n')
 
 class DrillHitEx(DrillHit):
@@ -223,6 +378,9 @@ class DrillHitEx(DrillHit):
     def rotate(self, angle, center=(0, 0)):
         self.position = rotate(*self.position, angle, center)
 
+    def transform(self, transform):
+        self.position = transform.point(*self.position)
+
     def to_excellon(self, settings):
         return CoordinateStmtEx(*self.position).to_excellon(settings)
 
@@ -239,6 +397,10 @@ class DrillSlotEx(DrillSlot):
         self.start = rotate(*self.start, angle, center)
         self.end = rotate(*self.end, angle, center)
 
+    def transform(self, transform):
+        self.start = transform.point(*self.start)
+        self.end = transform.point(*self.end)
+
     def to_excellon(self, settings):
         return SlotStmt(*self.start, *self.end).to_excellon(settings)
 
@@ -247,6 +409,7 @@ class DrillRout(object):
     MODE_LINEAR = 'G01'
     MODE_CIRCULER_CW = 'G02'
     MODE_CIRCULER_CCW = 'G03'
+    MODE_MIRRORING = {MODE_CIRCULER_CW: MODE_CIRCULER_CCW, MODE_CIRCULER_CCW: MODE_CIRCULER_CW}
 
     class Node(object):
         def __init__(self, mode, x, y, radius=None, center_offset=None):
@@ -299,6 +462,16 @@ class DrillRout(object):
             if node.center_offset is not None:
                 node.center_offset = rotate(*node.center_offset, angle, (0., 0.))
 
+    def transform(self, transform):
+        for node in self.nodes:
+            node.position = transform.point(*node.position)
+            if node.radius is not None:
+                node.radius *= transform.scale
+            if node.center_offset is not None:
+                node.center_offset = transform.vector(*node.center_offset)
+            if transform.mirrored:
+                node.mode = self.MODE_MIRRORING.get(node.mode, node.mode)
+
 class UnitStmtEx(UnitStmt):
     @classmethod
     def from_statement(cls, stmt):
@@ -402,3 +575,68 @@ class CoordinateStmtEx(CoordinateStmt):
             coord_str += 'J: %g ' % self.j
 
         return '<Coordinate Statement: %s>' % (coord_str)
+
+class ExcellonParserEx(ExcellonParser):
+    # blocks which make coordinate or unit statements are parsed here to create
+    # extended statements, others are delegated to ExcellonParser.
+    # gerber.excellon globals are left untouched, so parser instances can be
+    # used concurrently
+    PRECEDING_BLOCKS = ('M48', 'M95', 'M15', 'M16', 'M17', 'M30', 'G00', 'G01', 'G05')
+
+    def _parse_line(self, line):
+        line = self._previous_line + line
+        self._previous_line = ''
+        if not line.strip():
+            return
+        head = line[:3]
+        if head == 'G00' or head == 'G01':
+            if line.strip() == head:
+                # coordinates may be on the next line
+                self._previous_line = line
+                return
+            self.statements.append(RouteModeStmt())
+            self.state = 'ROUT' if head == 'G00' else 'LINEAR'
+            stmt = CoordinateStmtEx.from_excellon(line[3:], self._settings())
+            stmt.mode = self.state
+            start = tuple(self.pos)
+            self._move(stmt)
+            if head == 'G01' and self.drill_down:
+                self.hits.append(DrillSlot(self._tool(), start, tuple(self.pos),
+                                           DrillSlot.TYPE_ROUT))
+                self.active_tool._hit()
+        elif ('INCH' in line or 'METRIC' in line) and line[0] not in ';%' and \
+             head not in self.PRECEDING_BLOCKS and not (head == 'M00' and self.state == 'DRILL'):
+            stmt = UnitStmtEx.from_excellon(line)
+            self.units = stmt.units
+            self.zeros = stmt.zeros
+            if stmt.format:
+                self.format = stmt.format
+            self.statements.append(stmt)
+        elif line[0] in 'XY' and 'G85' not in line:
+            stmt = CoordinateStmtEx.from_excellon(line, self._settings())
+            start = tuple(self.pos)
+            self._move(stmt)
+            if self.state == 'LINEAR' and self.drill_down:
+                # pcb-tools does not count these rout slots as hits of the tool
+                self.hits.append(DrillSlot(self._tool(), start, tuple(self.pos),
+                                           DrillSlot.TYPE_ROUT))
+            elif self.state == 'DRILL' or self.state == 'HEADER':
+                self.hits.append(DrillHit(self._tool(), tuple(self.pos)))
+                self.active_tool._hit()
+        else:
+            super(ExcellonParserEx, self)._parse_line(line)
+
+    def _move(self, stmt):
+        self.statements.append(stmt)
+        for axis, value in enumerate((stmt.x, stmt.y)):
+            if value is None:
+                continue
+            if self.notation == 'absolute':
+                self.pos[axis] = value
+            else:
+                self.pos[axis] += value
+
+    def _tool(self):
+        if not self.active_tool:
+            self.active_tool = self._get_tool(1)
+        return self.active_tool
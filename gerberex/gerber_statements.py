@@ -73,6 +73,10 @@ class AMParamStmtEx(AMParamStmt):
         for primitive_def in self.primitive_defs:
             primitive_def.rotate(angle, center)
 
+    def mirror(self, x=True, y=False):
+        for primitive_def in self.primitive_defs:
+            primitive_def.mirror(x, y)
+
 class ADParamStmtEx(ADParamStmt):
     GEOMETRIES = {
         'C': [0,1],
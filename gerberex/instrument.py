@@ -0,0 +1,172 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# Copyright 2019 Hiroshi Murayama <opiopan@gmail.com>
+
+import time
+import json
+from contextlib import contextmanager
+
+# report being recorded, hooks do nothing but checking this while it is None
+_report = None
+# key of data which is not loaded from a file, such as DxfFile.rectangle()
+UNKNOWN_SOURCE = '<unknown>'
+
+class Report(object):
+    # phases: name of phase to number of calls and elapsed seconds,
+    #         phases may be nested and each of them includes nested ones
+    # statements: source file to number of statements of each type
+    # bytes_written: source file to size of output data made from it
+    # outputs: output file to its size
+    def __init__(self):
+        self.phases = {}
+        self.statements = {}
+        self.bytes_written = {}
+        self.outputs = {}
+
+    def add_phase(self, name, seconds, calls=1):
+        entry = self.phases.get(name)
+        if entry is None:
+            self.phases[name] = [calls, seconds]
+        else:
+            entry[0] += calls
+            entry[1] += seconds
+
+    def add_statements(self, source, counts):
+        entry = self.statements.setdefault(_key(source), {})
+        for name in counts:
+            entry[name] = entry.get(name, 0) + counts[name]
+
+    def add_bytes(self, source, size):
+        source = _key(source)
+        self.bytes_written[source] = self.bytes_written.get(source, 0) + size
+
+    def add_output(self, path, size):
+        self.outputs[path] = size
+
+    def merge(self, data):
+        # data is a dict returned by to_dict(), such as report of other process
+        for name, entry in data['phases'].items():
+            self.add_phase(name, entry['seconds'], entry['calls'])
+        for source, counts in data['statements'].items():
+            self.add_statements(source, counts)
+        for source, size in data['bytes_written'].items():
+            self.add_bytes(source, size)
+        self.outputs.update(data['outputs'])
+
+    def to_dict(self):
+        return {
+            'phases': dict((name, {'calls': calls, 'seconds': seconds})
+                           for name, (calls, seconds) in self.phases.items()),
+            'statements': dict((source, dict(counts))
+                               for source, counts in self.statements.items()),
+            'bytes_written': dict(self.bytes_written),
+            'outputs': dict(self.outputs),
+        }
+
+    def dump(self, path):
+        with open(path, 'w') as f:
+            json.dump(self.to_dict(), f, indent=2, sort_keys=True)
+
+@contextmanager
+def recording():
+    # hooks record into a new report while in this context.
+    # report of nested context is merged into outer one when it exits
+    global _report
+    previous = _report
+    report = _report = Report()
+    try:
+        yield report
+    finally:
+        _report = previous
+        if previous is not None:
+            previous.merge(report.to_dict())
+
+def enabled():
+    return _report is not None
+
+def phase(name):
+    # context manager to measure a phase
+    return _NULL_PHASE if _report is None else _Phase(_report, name)
+
+def timed(name, function):
+    # returns function which measures each call as a phase.
+    # intended for functions called per statement, so it should be taken
+    # once before loop
+    report = _report
+    if report is None:
+        return function
+    clock = time.perf_counter
+    def measured(*args, **kwargs):
+        start = clock()
+        try:
+            return function(*args, **kwargs)
+        finally:
+            report.add_phase(name, clock() - start)
+    return measured
+
+def merge(data):
+    # merges report made by Report.to_dict(), such as one of other process
+    if _report is not None:
+        _report.merge(data)
+
+def count_statements(source, statements):
+    if _report is None:
+        return
+    counts = {}
+    for statement in statements:
+        name = type(statement).__name__
+        counts[name] = counts.get(name, 0) + 1
+    _report.add_statements(source, counts)
+
+def add_bytes(source, size):
+    if _report is not None:
+        _report.add_bytes(source, size)
+
+def add_output(path, size):
+    if _report is not None:
+        _report.add_output(path, size)
+
+def counted(source, lines):
+    # passes through lines to be written and adds their size to source
+    if _report is None:
+        return lines
+    return _counted(_report, source, lines)
+
+def _counted(report, source, lines):
+    size = 0
+    try:
+        for line in lines:
+            size += len(line)
+            yield line
+    finally:
+        report.add_bytes(source, size)
+
+def _key(source):
+    return UNKNOWN_SOURCE if source is None else source
+
+class _Phase(object):
+    __slots__ = ('report', 'name', 'start')
+
+    def __init__(self, report, name):
+        self.report = report
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, type, value, traceback):
+        self.report.add_phase(self.name, time.perf_counter() - self.start)
+        return False
+
+class _NullPhase(object):
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, type, value, traceback):
+        return False
+
+_NULL_PHASE = _NullPhase()
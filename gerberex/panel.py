@@ -0,0 +1,177 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# Copyright 2019 Hiroshi Murayama <opiopan@gmail.com>
+
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+import gerberex.common
+import gerberex.excellon
+import gerberex.instrument as instrument
+from gerberex.dxf import DxfFile
+from gerberex.composition import GerberComposition, DrillComposition, MergeJob, \
+                                 load_merge_job
+
+class PanelBuilder(object):
+    # builds all layers of a panel from one placement list.
+    # boards: dict of board name to dict of layer name to file path
+    # placements: list of (board name, x offset, y offset, angle)
+    # extras: dict of layer name to list of MergeJob merged after boards,
+    #         such as outline or mouse bites data
+    # layers are independent, so each layer is built in a worker process
+    # cache: FileCache or its directory, to share parsed sources across runs
+    def __init__(self, boards, placements, extras=None, units='metric', workers=None,
+                 cache=None):
+        self.boards = boards
+        self.placements = placements
+        self.extras = extras if extras is not None else {}
+        self.units = units
+        self.workers = workers
+        self.cache = cache
+        self.timings = {}
+
+    def layers(self):
+        names = []
+        for name, x_offset, y_offset, angle in self.placements:
+            for layer in self.boards[name]:
+                if layer not in names:
+                    names.append(layer)
+        for layer in self.extras:
+            if layer not in names:
+                names.append(layer)
+        return names
+
+    def build(self, outputs):
+        # outputs: dict of layer name to output path, or function which
+        # returns output path for a layer name.
+        # returns dict of layer name to elapsed seconds to build the layer
+        self.timings = build_panels([(self, outputs)], self.workers)[0]
+        return self.timings
+
+    def tasks(self, outputs):
+        if not callable(outputs):
+            outputs = outputs.__getitem__
+        return [self._layer_task(layer, outputs(layer)) for layer in self.layers()]
+
+    def _layer_task(self, layer, output):
+        placements = [(self.boards[name][layer], x_offset, y_offset, angle)
+                      for name, x_offset, y_offset, angle in self.placements
+                      if layer in self.boards[name]]
+        extras = [job if isinstance(job, MergeJob) else MergeJob(*job)
+                  for job in self.extras.get(layer, [])]
+        return (layer, placements, extras, output, self.units, self.cache)
+
+    @classmethod
+    def from_spec(cls, spec, directory='', workers=None, cache=None):
+        # creates builder and output path function from panel spec which is
+        # a dict loaded from JSON or TOML. relative paths are resolved from
+        # directory. see README.md for format of spec
+        def path(name):
+            return os.path.join(directory, name)
+        def board_layers(board):
+            if isinstance(board, str):
+                return dict((layer, path(board.format(layer=layer)))
+                            for layer in spec['layers'])
+            return dict((layer, path(name)) for layer, name in board.items())
+        def placement(item):
+            if isinstance(item, dict):
+                return (item['board'], item.get('x', 0), item.get('y', 0), item.get('angle', 0))
+            name, x_offset, y_offset, angle = (list(item) + [0, 0, 0])[:4]
+            return (name, x_offset, y_offset, angle)
+        boards = dict((name, board_layers(board)) for name, board in spec['boards'].items())
+        placements = [placement(item) for item in spec['placements']]
+        layers = PanelBuilder(boards, placements).layers()
+        extras = {}
+        for item in spec.get('extras', []):
+            job = _spec_job(item, path)
+            for layer in item.get('layers', layers):
+                extras.setdefault(layer, []).append(job)
+        output = path(spec['output'])
+        if '{layer}' not in output:
+            output += '.{layer}'
+        builder = cls(boards, placements, extras, spec.get('units', 'metric'), workers, cache)
+        return builder, lambda layer: output.format(layer=layer)
+
+def build_panels(panels, workers=None):
+    # builds layers of several panels with one worker pool.
+    # panels: list of (PanelBuilder, outputs)
+    # returns list of timings of each panel.
+    # if instrumentation is recording, reports of workers are merged into it
+    tasks = [(num, task) for num, (builder, outputs) in enumerate(panels)
+             for task in builder.tasks(outputs)]
+    if workers == 1 or len(tasks) < 2:
+        results = [build_layer(*task) for num, task in tasks]
+    else:
+        profile = instrument.enabled()
+        with ProcessPoolExecutor(workers) as executor:
+            futures = [executor.submit(_build_layer, task, profile) for num, task in tasks]
+            results = []
+            for future in futures:
+                elapsed, report = future.result()
+                if report is not None:
+                    instrument.merge(report)
+                results.append(elapsed)
+    timings = [{} for panel in panels]
+    for (num, task), elapsed in zip(tasks, results):
+        timings[num][task[0]] = elapsed
+    return timings
+
+DRAW_MODES = {
+    'line': DxfFile.DM_LINE,
+    'fill': DxfFile.DM_FILL,
+    'mouse_bites': DxfFile.DM_MOUSE_BITES,
+}
+
+def _spec_job(item, path):
+    if isinstance(item, str):
+        return MergeJob(path(item))
+    attributes = {}
+    for key, value in item.items():
+        if key in ('path', 'layers', 'x', 'y', 'angle', 'units'):
+            continue
+        if key == 'draw_mode':
+            value = DRAW_MODES[value]
+        elif key == 'format':
+            value = tuple(value)
+        attributes[key] = value
+    return MergeJob(path(item['path']), item.get('x', 0), item.get('y', 0),
+                    item.get('angle', 0), item.get('units'), attributes)
+
+def _build_layer(task, profile):
+    if not profile:
+        return build_layer(*task), None
+    with instrument.recording() as report:
+        elapsed = build_layer(*task)
+    return elapsed, report.to_dict()
+
+def build_layer(layer, placements, extras, output, units, cache=None):
+    # each source file is read once and merged as clones
+    start = time.perf_counter()
+    sources = {}
+    for path, x_offset, y_offset, angle in placements:
+        if path not in sources:
+            sources[path] = gerberex.common.read(path, lean=True, cache=cache)
+    extra_files = [load_merge_job(job, cache) for job in extras]
+    # layer is drilled if any of board files or extras is drill data
+    if any(isinstance(file, gerberex.excellon.ExcellonFileEx)
+           for file in list(sources.values()) + extra_files):
+        ctx = DrillComposition()
+    else:
+        ctx = GerberComposition()
+    for path, x_offset, y_offset, angle in placements:
+        file = sources[path].clone()
+        if units == 'metric':
+            file.to_metric()
+        elif units == 'inch':
+            file.to_inch()
+        file.rotate(angle)
+        file.offset(x_offset, y_offset)
+        ctx.merge(file)
+    for file in extra_files:
+        ctx.merge(file)
+    directory = os.path.dirname(output)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    ctx.dump(output)
+    return time.perf_counter() - start
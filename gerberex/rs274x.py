@@ -4,22 +4,281 @@
 # Copyright 2019 Hiroshi Murayama <opiopan@gmail.com>
 
 from gerber.cam import FileSettings
+from gerber.utils import MILLIMETERS_PER_INCH
 import gerber.rs274x
 from gerber.gerber_statements import *
 from gerberex.gerber_statements import AMParamStmt, AMParamStmtEx, ADParamStmtEx
-from gerberex.utility import rotate
+from gerberex.utility import rotate, shallow_copy, value_formatter, Transform, ENCODING
+from gerberex.columns import CoordColumns, is_available as is_columns_available
+import gerberex.instrument as instrument
+import os
 import re
+import copy
+
+CHUNK_SIZE = 1024 * 1024
 
 def loads(data, filename=None):
-    cls = gerber.rs274x.GerberParser
-    cls.SF = \
-        r"(?P<param>SF)(A(?P<a>{decimal}))?(B(?P<b>{decimal}))?".format(decimal=cls.DECIMAL)
-    cls.PARAMS = (cls.FS, cls.MO, cls.LP, cls.AD_CIRCLE, 
-                  cls.AD_RECT, cls.AD_OBROUND, cls.AD_POLY,
-                  cls.AD_MACRO, cls.AM, cls.AS, cls.IF, cls.IN, 
-                  cls.IP, cls.IR, cls.MI, cls.OF, cls.SF, cls.LN)
-    cls.PARAM_STMT = [re.compile(r"%?{0}\*%?".format(p)) for p in cls.PARAMS]
-    return cls().parse_raw(data, filename)
+    return GerberParser().parse_raw(data, filename)
+
+def loads_lean(data, filename=None):
+    # statements only mode, neither primitives nor apertures of pcb-tools are
+    # built and parsed statements are not retained after normalization
+    parser = GerberParser()
+    return GerberFile(parser.iter_statements((data,), filename), parser.settings,
+                      [], [], filename, keep_statements=False)
+
+_DELIMITER = r'([\r\n])|(\*)|(%)'
+_STR_DELIMITER = re.compile(_DELIMITER)
+_BYTES_DELIMITER = re.compile(_DELIMITER.encode())
+_NEWLINE = 1
+_ASTERISK = 2
+_PERCENT = 3
+
+def split_commands(chunks):
+    # incremental version of GerberParser._split_commands(),
+    # data is given as a sequence of chunks instead of a whole string.
+    # chunks may be bytes-like objects such as mmap, they are scanned in place
+    # and only extracted commands are decoded
+    rest = None
+    in_header = True
+    for chunk in chunks:
+        if rest is None:
+            is_text = isinstance(chunk, str)
+            delimiter = _STR_DELIMITER if is_text else _BYTES_DELIMITER
+            data = chunk
+        elif rest:
+            data = rest + chunk
+        else:
+            data = chunk
+        start = 0
+        for match in delimiter.finditer(data):
+            cur = match.start()
+            kind = match.lastindex
+            if kind == _PERCENT and start == cur:
+                in_header = True
+            elif kind == _NEWLINE:
+                if start != cur:
+                    yield data[start:cur] if is_text else str(data[start:cur], ENCODING)
+                start = cur + 1
+            elif kind == _ASTERISK:
+                if not in_header:
+                    yield data[start:cur + 1] if is_text else str(data[start:cur + 1], ENCODING)
+                    start = cur + 1
+            elif in_header:
+                yield data[start:cur + 1] if is_text else str(data[start:cur + 1], ENCODING)
+                start = cur + 1
+                in_header = False
+        rest = data[start:] if is_text else bytes(data[start:])
+
+def value_parser(format=(2, 5), zero_suppression='trailing'):
+    # returns a function which has same result as gerber.utils.parse_gerber_value()
+    # for signed integer notation. integer division is correctly rounded as
+    # well as float() of decimal notation, so the result is bit identical
+    integer_digits, decimal_digits = format
+    max_digits = integer_digits + decimal_digits
+    if max_digits > 13 or integer_digits > 6 or decimal_digits > 7:
+        raise ValueError('Parser only supports precision up to 6:7 format')
+    scale = 10 ** decimal_digits
+    padding = ['0' * n for n in range(max_digits + 1)]
+
+    def parse(value):
+        negative = value[0] == '-'
+        digits = value[1:] if negative or value[0] == '+' else value
+        num_digits = len(digits)
+        if num_digits <= max_digits and zero_suppression == 'leading':
+            result = int(digits) / scale
+        elif num_digits < max_digits and zero_suppression == 'trailing':
+            result = int(digits + padding[max_digits - num_digits]) / scale
+        elif num_digits > integer_digits:
+            result = int(digits) / 10 ** (num_digits - integer_digits)
+        else:
+            result = float(int(digits))
+        return -result if negative else result
+    return parse
+
+def parse_value(value, format=(2, 5), zero_suppression='trailing'):
+    return value_parser(format, zero_suppression)(value)
+
+_GerberParser = gerber.rs274x.GerberParser
+
+class GerberParser(_GerberParser):
+    # regexes are compiled once here instead of overwriting attributes of
+    # pcb-tools parser, so parser instances can be used concurrently
+    SF = r"(?P<param>SF)(A(?P<a>{decimal}))?(B(?P<b>{decimal}))?".format(
+        decimal=_GerberParser.DECIMAL)
+    PARAMS = (_GerberParser.FS, _GerberParser.MO, _GerberParser.LP, _GerberParser.AD_CIRCLE,
+              _GerberParser.AD_RECT, _GerberParser.AD_OBROUND, _GerberParser.AD_POLY,
+              _GerberParser.AD_MACRO, _GerberParser.AM, _GerberParser.AS, _GerberParser.IF,
+              _GerberParser.IN, _GerberParser.IP, _GerberParser.IR, _GerberParser.MI,
+              _GerberParser.OF, SF, _GerberParser.LN)
+    PARAM_STMT = [re.compile(r"%?{0}\*%?".format(p)) for p in PARAMS]
+
+    FAST_STMT = re.compile(
+        r"(?:(G0?[123])?"
+        r"(?:X([\+-]?\d+))?(?:Y([\+-]?\d+))?"
+        r"(?:I([\+-]?\d+))?(?:J([\+-]?\d+))?"
+        r"(D0?[123])?"
+        r"|(G5[45])?D(\d+)"
+        r"|(G3[67]|G7[45]))\*$")
+
+    def _split_commands(self, data):
+        return split_commands((data,))
+
+    def iter_statements(self, chunks, filename=None):
+        # statements are yielded without evaluation,
+        # self.settings is fixed once all statements are consumed
+        self.filename = filename
+        for stmt in self._parse(split_commands(chunks)):
+            stmt.units = self.settings.units
+            yield stmt
+
+    def _parse(self, data):
+        # coordinate, aperture selection and mode blocks are recognized by one
+        # combined regex, other blocks are handled by _parse_block
+        settings = self.settings
+        fast_match = self.FAST_STMT.match
+        value_format = None
+        oldline = ''
+        for command in data:
+            line = oldline + command.strip()
+            oldline = ''
+            if not line:
+                continue
+            if line[0] == '%':
+                if not line.endswith('%') and '%' not in line[1:]:
+                    oldline = line
+                    continue
+            elif line[0] != '*':
+                match = fast_match(line)
+                if match:
+                    function, x, y, i, j, op, deprecated, d, mode = match.groups()
+                    if mode is not None:
+                        if mode == 'G36' or mode == 'G37':
+                            yield RegionModeStmt('on' if mode == 'G36' else 'off')
+                        else:
+                            yield QuadrantModeStmt(
+                                'single-quadrant' if mode == 'G74' else 'multi-quadrant')
+                    elif d is not None:
+                        yield ApertureStmt(d, deprecated)
+                    else:
+                        if value_format != (settings.format, settings.zero_suppression):
+                            value_format = (settings.format, settings.zero_suppression)
+                            value = value_parser(*value_format)
+                        yield CoordStmt(function,
+                                        value(x) if x is not None else None,
+                                        value(y) if y is not None else None,
+                                        value(i) if i is not None else None,
+                                        value(j) if j is not None else None,
+                                        op, settings)
+                    continue
+            # other blocks are consumed one by one from the head of line,
+            # text which is not recognized is carried over to next command
+            while line:
+                stmts, rest = self._parse_block(line)
+                if rest is None:
+                    break
+                for stmt in stmts:
+                    yield stmt
+                line = rest
+            oldline = line
+
+    def _parse_block(self, line):
+        # returns statements of a block at the head of line and rest of line.
+        # rest is None if no block is recognized.
+        # blocks are tried in same order as pcb-tools parser
+        if line[0] == '*':
+            return ([], line[1:])
+        match = self.COORD_STMT.match(line)
+        if match:
+            return ([CoordStmt.from_dict(match.groupdict(), self.settings)], line[match.end():])
+        match = self.APERTURE_STMT.match(line)
+        if match:
+            return ([ApertureStmt(**match.groupdict())], line[match.end():])
+        for expression in self.PARAM_STMT:
+            match = expression.match(line)
+            if match:
+                return (self._parse_param(match.groupdict(), line), line[match.end():])
+        match = self.REGION_MODE_STMT.match(line)
+        if match:
+            return ([RegionModeStmt.from_gerber(line)], line[match.end():])
+        match = self.QUAD_MODE_STMT.match(line)
+        if match:
+            return ([QuadrantModeStmt.from_gerber(line)], line[match.end():])
+        match = self.COMMENT_STMT.match(line)
+        if match:
+            return ([CommentStmt(match.group('comment'))], line[match.end():])
+        match = self.DEPRECATED_UNIT.match(line)
+        if match:
+            stmt = MOParamStmt(param='MO', mo='inch' if 'G70' in match.group('mode') else 'metric')
+            self.settings.units = stmt.mode
+            return ([stmt], line[match.end():])
+        match = self.DEPRECATED_FORMAT.match(line)
+        if match:
+            return ([DeprecatedStmt.from_gerber(line)], line[match.end():])
+        match = self.EOF_STMT.match(line)
+        if match:
+            return ([EofStmt()], line[match.end():])
+        if line.find('*') > 0:
+            return ([UnknownStmt(line)], '')
+        return ([], None)
+
+    # parameters which are converted to statements without side effects
+    PARAM_CLASSES = {
+        'LP': LPParamStmt, 'AD': ADParamStmt, 'OF': OFParamStmt, 'IN': INParamStmt,
+        'LN': LNParamStmt, 'AS': ASParamStmt, 'IP': IPParamStmt, 'IR': IRParamStmt,
+        'MI': MIParamStmt, 'SF': SFParamStmt,
+    }
+
+    def _parse_param(self, param, line):
+        name = param['param']
+        if name == 'FS':
+            stmt = FSParamStmt.from_dict(param)
+            self.settings.zero_suppression = stmt.zero_suppression
+            self.settings.format = stmt.format
+            self.settings.notation = stmt.notation
+            return [stmt]
+        elif name == 'MO':
+            stmt = MOParamStmt.from_dict(param)
+            self.settings.units = stmt.mode
+            return [stmt]
+        elif name == 'AM':
+            stmt = AMParamStmt.from_dict(param)
+            stmt.units = self.settings.units
+            return [stmt]
+        elif name == 'IF':
+            if self._recursion_depth >= self.INCLUDE_FILE_RECURSION_LIMIT:
+                raise IOError('Include file nesting depth limit exceeded.')
+            self._recursion_depth += 1
+            with open(os.path.join(os.path.dirname(self.filename), param['filename']), 'r') as f:
+                stmts = list(self._parse(self._split_commands(f.read())))
+            self._recursion_depth -= 1
+            return stmts
+        elif name in self.PARAM_CLASSES:
+            return [self.PARAM_CLASSES[name].from_dict(param)]
+        else:
+            return [UnknownStmt(line)]
+
+def iter_gerber(filename, context=None, chunk_size=CHUNK_SIZE):
+    if context is None:
+        context = GerberContext()
+    parser = GerberParser()
+    rotator = None
+    with open(filename, 'rb') as f:
+        chunks = iter(lambda: f.read(chunk_size), b'')
+        for stmt in parser.iter_statements(chunks, filename):
+            type, stmts = context.normalize_statement(stmt)
+            if type == context.TYPE_NONE:
+                continue
+            if context.angle != 0 and rotator is None:
+                rotator = _StreamRotator(context)
+            for stmt in stmts:
+                if context.is_negative and isinstance(stmt, LPParamStmt):
+                    stmt.lp = 'dark' if stmt.lp == 'clear' else 'clear'
+                if rotator is not None:
+                    for item in rotator.rotate(type, stmt):
+                        yield item
+                else:
+                    yield (type, stmt)
 
 def write_gerber_header(file, settings):
     file.write('%s\n%s\n%%IPPOS*%%\n' % (
@@ -27,23 +286,62 @@ def write_gerber_header(file, settings):
                FSParamStmt('FS', settings.zero_suppression, 
                            settings.notation, settings.format).to_gerber(settings)))
 
+def format_statements(statements, settings, columns=None, aperture_map=None):
+    # yields output lines of main statements.
+    # coordinates are formatted in bulk from columns if specified, otherwise
+    # each coordinate is formatted by scalar formatter with same result.
+    # D-codes of aperture selections are replaced if aperture_map is specified
+    if columns is not None:
+        coords = iter(columns.to_gerber(settings))
+        format_coord = lambda statement: next(coords)
+    else:
+        format_value = value_formatter(settings.format, settings.zero_suppression)
+        def format_coord(statement):
+            return ''.join((
+                statement.function or '',
+                'X' + format_value(statement.x) if statement.x is not None else '',
+                'Y' + format_value(statement.y) if statement.y is not None else '',
+                'I' + format_value(statement.i) if statement.i is not None else '',
+                'J' + format_value(statement.j) if statement.j is not None else '',
+                statement.op or '', '*'))
+    for statement in statements:
+        if isinstance(statement, CoordStmt):
+            yield format_coord(statement)
+        elif aperture_map is not None and isinstance(statement, ApertureStmt):
+            statement = shallow_copy(statement)
+            statement.d = aperture_map[statement.d]
+            yield statement.to_gerber(settings)
+        else:
+            yield statement.to_gerber(settings)
+
+ARC_MIRRORING = {'G02': 'G03', 'G2': 'G03', 'G03': 'G02', 'G3': 'G02'}
+
 class GerberFile(gerber.rs274x.GerberFile):
+    _shared = False
+    _shared_statements = False
+    _transform = Transform()
+    _columns = None
+
     @classmethod
     def from_gerber_file(cls, gerber_file):
         if not isinstance(gerber_file, gerber.rs274x.GerberFile):
             raise Exception('only gerber.rs274x.GerberFile object is specified')
         
         return cls(gerber_file.statements, gerber_file.settings, gerber_file.primitives,\
-                   gerber_file.apertures, gerber_file.filename)
+                   list(gerber_file.apertures), gerber_file.filename)
 
-    def __init__(self, statements, settings, primitives, apertures, filename=None):
-        super(GerberFile, self).__init__(statements, settings, primitives, apertures, filename)
-        self.context = GerberContext.from_settings(self.settings)
+    def __init__(self, statements, settings, primitives, apertures, filename=None,
+                 keep_statements=True):
+        self.context = GerberContext.from_settings(settings)
         self.aperture_macros = {}
         self.aperture_defs = []
         self.main_statements = []
-        for stmt in self.statements:
-            type, stmts = self.context.normalize_statement(stmt)
+        if keep_statements:
+            statements = list(statements)
+        normalize = instrument.timed('rs274x.normalize_statement',
+                                     self.context.normalize_statement)
+        for stmt in statements:
+            type, stmts = normalize(stmt)
             if type == self.context.TYPE_AM:
                 for mdef in stmts:
                     self.aperture_macros[mdef.name] = mdef
@@ -51,6 +349,9 @@ class GerberFile(gerber.rs274x.GerberFile):
                 self.aperture_defs.extend(stmts)
             elif type == self.context.TYPE_MAIN:
                 self.main_statements.extend(stmts)
+        # settings may be updated while statements are consumed
+        super(GerberFile, self).__init__(statements if keep_statements else [],
+                                         settings, primitives, apertures, filename)
         if self.context.angle != 0:
             self.rotate(self.context.angle)
         if self.context.is_negative:
@@ -58,6 +359,69 @@ class GerberFile(gerber.rs274x.GerberFile):
         self.context.notation = 'absolute'
         self.context.zeros = 'trailing'
 
+    def clone(self):
+        # statements are shared until either file is modified,
+        # pcb-tools statements and primitives are not carried over
+        clone = shallow_copy(self)
+        clone.context = shallow_copy(self.context)
+        clone.statements = []
+        clone.primitives = []
+        self._shared = clone._shared = True
+        self._shared_statements = clone._shared_statements = True
+        return clone
+
+    def _own(self):
+        if self._shared:
+            self.aperture_macros = copy.deepcopy(self.aperture_macros)
+            self.aperture_defs = copy.deepcopy(self.aperture_defs)
+            self.statements = []
+            self.primitives = []
+            self._shared = False
+
+    def _own_statements(self):
+        if self._shared_statements:
+            self._main_statements = [shallow_copy(s) for s in self._main_statements]
+            self._shared_statements = False
+
+    @property
+    def main_statements(self):
+        # coordinates are transformed lazily when statements are referred
+        self._apply_transform()
+        return self._main_statements
+
+    @main_statements.setter
+    def main_statements(self, statements):
+        # specified statements must be in current coordinate system
+        self._main_statements = statements
+        self._shared_statements = False
+        self._transform = Transform()
+        self._columns = None
+
+    def drawing_statements(self):
+        # returns main statements and their coordinate columns for output.
+        # coordinates of returned statement objects are not up to date
+        # if columns is not None
+        columns = self.columns
+        if columns is None:
+            return (self.main_statements, None)
+        return (self._main_statements, columns)
+
+    @property
+    def columns(self):
+        # columnar backing of coordinates in main statements (requires numpy).
+        # once this is referred, transformations are applied to columns as
+        # vectorized operations and statement objects are updated only when
+        # main_statements is referred
+        if not is_columns_available():
+            return None
+        if self._columns is None:
+            self._columns = CoordColumns.from_statements(self._main_statements)
+        if not self._transform.is_identity:
+            with instrument.phase('rs274x.transform'):
+                self._columns = self._columns.transformed(self._transform)
+            self._transform = Transform()
+        return self._columns
+
     def write(self, filename=None):
         self.context.notation = 'absolute'
         self.context.zeros = 'trailing'
@@ -70,111 +434,188 @@ class GerberFile(gerber.rs274x.GerberFile):
                 f.write(self.aperture_macros[macro].to_gerber(self.context) + '\n')
             for aperture in self.aperture_defs:
                 f.write(aperture.to_gerber(self.context) + '\n')
-            for statement in self.main_statements:
-                f.write(statement.to_gerber(self.context) + '\n')
+            statements, columns = self.drawing_statements()
+            f.writelines(line + '\n' for line in
+                         format_statements(statements, self.context, columns))
             f.write('M02*\n')
 
     def to_inch(self):
         if self.units == 'metric':
+            self._own()
             for macro in self.aperture_macros:
                 self.aperture_macros[macro].to_inch()
             for aperture in self.aperture_defs:
                 aperture.to_inch()
-            for statement in self.statements:
-                statement.to_inch()
+            self._transform = self._transform.scaled(1. / MILLIMETERS_PER_INCH)
             self.units = 'inch'
             self.context.units = 'inch'
 
     def to_metric(self):
         if self.units == 'inch':
+            self._own()
             for macro in self.aperture_macros:
                 self.aperture_macros[macro].to_metric()
             for aperture in self.aperture_defs:
                 aperture.to_metric()
-            for statement in self.statements:
-                statement.to_metric()
+            self._transform = self._transform.scaled(MILLIMETERS_PER_INCH)
             self.units='metric'
             self.context.units='metric'
 
     def offset(self, x_offset=0, y_offset=0):
-        for statement in self.main_statements:
-            if isinstance(statement, CoordStmt):
-                if statement.x is not None:
-                    statement.x += x_offset
-                if statement.y is not None:
-                    statement.y += y_offset
+        self._transform = self._transform.translated(x_offset, y_offset)
         for primitive in self.primitives:
             primitive.offset(x_offset, y_offset)
 
     def rotate(self, angle, center=(0,0)):
         if angle % 360 == 0:
             return
-        self._generalize_aperture()
-        last_x = 0
-        last_y = 0
-        last_rx = 0
-        last_ry = 0
+        self._own()
+        with instrument.phase('rs274x.generalize_aperture'):
+            self._generalize_aperture()
         for name in self.aperture_macros:
             self.aperture_macros[name].rotate(angle, center)
-        for statement in self.main_statements:
-            if isinstance(statement, CoordStmt) and statement.x != None and statement.y != None:
-                if statement.i != None and statement.j != None:
-                    cx = last_x + statement.i
-                    cy = last_y + statement.j
-                    cx, cy = rotate(cx, cy, angle, center)
-                    statement.i = cx - last_rx
-                    statement.j = cy - last_ry
-                last_x = statement.x
-                last_y = statement.y
-                last_rx, last_ry = rotate(statement.x, statement.y, angle, center)
-                statement.x = last_rx
-                statement.y = last_ry
-    
+        self._transform = self._transform.rotated(angle, center)
+
+    def mirror(self, x=True, y=False, center=(0, 0)):
+        # x: negate x coordinates such as bottom layers seen from top side
+        # y: negate y coordinates
+        if not x and not y:
+            return
+        self._own()
+        for name in self.aperture_macros:
+            self.aperture_macros[name].mirror(x, y)
+        transform = Transform().mirrored_by(x, y)
+        for statement in self.aperture_defs:
+            if isinstance(statement, ADParamStmt) and statement.shape == 'P':
+                modifiers = list(statement.modifiers[0])
+                modifiers[2:3] = [transform.direction(modifiers[2] if len(modifiers) > 2 else 0) % 360]
+                statement.modifiers = [tuple(modifiers)]
+        self._transform = self._transform.mirrored_by(x, y, center)
+
     def nagate_polarity(self):
-        for statement in self.main_statements:
+        self._own_statements()
+        for statement in self._main_statements:
             if isinstance(statement, LPParamStmt):
                 statement.lp = 'dark' if statement.lp == 'clear' else 'clear'
-    
-    def _generalize_aperture(self):
-        RECTANGLE = 0
-        LANDSCAPE_OBROUND = 1
-        PORTRATE_OBROUND = 2
-        POLYGON = 3
-        macro_defs = [
-            ('MACR', AMParamStmtEx.rectangle),
-            ('MACLO', AMParamStmtEx.landscape_obround),
-            ('MACPO', AMParamStmtEx.portrate_obround),
-            ('MACP', AMParamStmtEx.polygon)
-        ]
 
+    def _apply_transform(self):
+        if self._columns is not None:
+            columns = self.columns
+            self._columns = None
+            if not columns.is_original:
+                with instrument.phase('rs274x.apply_columns'):
+                    self._own_statements()
+                    columns.apply(self._main_statements, self.units)
+            return
+        transform = self._transform
+        if transform.is_identity:
+            return
+        with instrument.phase('rs274x.transform'):
+            self._transform_statements(transform)
+
+    def _transform_statements(self, transform):
+        a, b, c, d, e, f = transform.matrix
+        arcs = ARC_MIRRORING if transform.mirrored else {}
+        units = self.units
+        shared = self._shared_statements
+        statements = list(self._main_statements) if shared else self._main_statements
+        for index, statement in enumerate(statements):
+            if shared:
+                statement = statements[index] = shallow_copy(statement)
+            if isinstance(statement, CoordStmt):
+                x, y, i, j = statement.x, statement.y, statement.i, statement.j
+                if x is not None and y is not None:
+                    statement.x = a * x + b * y + e
+                    statement.y = c * x + d * y + f
+                if i is not None and j is not None:
+                    statement.i = a * i + b * j
+                    statement.j = c * i + d * j
+                if statement.function in arcs:
+                    statement.function = arcs[statement.function]
+                statement.units = units
+        self._main_statements = statements
+        self._shared_statements = False
+        self._transform = Transform()
+
+    def _generalize_aperture(self):
         need_to_change = False
         for statement in self.aperture_defs:
-            if isinstance(statement, ADParamStmt) and statement.shape in ['R', 'O', 'P']:
+            if isinstance(statement, ADParamStmt) and statement.shape in GENERIC_SHAPES:
                 need_to_change = True
         
         if need_to_change:
-            for idx in range(0, len(macro_defs)):
-                macro_def = macro_defs[idx]
-                name = macro_def[0]
-                num = 1
-                while name in self.aperture_macros:
-                    name = '%s_%d' % (macro_def[0], num)
-                    num += 1
-                self.aperture_macros[name] = macro_def[1](name, self.units)
-                macro_defs[idx] = (name, macro_def[1])
+            names = _generic_macro_names(self.aperture_macros)
+            for name, factory in zip(names, GENERIC_MACROS):
+                self.aperture_macros[name] = factory(name, self.units)
             for statement in self.aperture_defs:
                 if isinstance(statement, ADParamStmt):
-                    if statement.shape == 'R':
-                        statement.shape = macro_defs[RECTANGLE][0]
-                    elif statement.shape == 'O':
-                        x = statement.modifiers[0][0] \
-                            if len(statement.modifiers[0]) > 0 else 0
-                        y = statement.modifiers[0][1] \
-                            if len(statement.modifiers[0]) > 1 else 0
-                        statement.shape = macro_defs[LANDSCAPE_OBROUND][0] \
-                                          if x > y else macro_defs[PORTRATE_OBROUND][0] 
-                    elif statement.shape == 'P':
-                        statement.shape = macro_defs[POLYGON][0]
+                    statement.shape = _generic_shape(statement, names)
+
+GENERIC_SHAPES = ('R', 'O', 'P')
+GENERIC_MACROS = (
+    AMParamStmtEx.rectangle,
+    AMParamStmtEx.landscape_obround,
+    AMParamStmtEx.portrate_obround,
+    AMParamStmtEx.polygon,
+)
+GENERIC_MACRO_NAMES = ('MACR', 'MACLO', 'MACPO', 'MACP')
+
+def _generic_macro_names(existing_names):
+    names = []
+    for base in GENERIC_MACRO_NAMES:
+        name = base
+        num = 1
+        while name in existing_names:
+            name = '%s_%d' % (base, num)
+            num += 1
+        names.append(name)
+    return names
+
+def _generic_shape(statement, names):
+    RECTANGLE = 0
+    LANDSCAPE_OBROUND = 1
+    PORTRATE_OBROUND = 2
+    POLYGON = 3
+    if statement.shape == 'R':
+        return names[RECTANGLE]
+    elif statement.shape == 'O':
+        x = statement.modifiers[0][0] \
+            if len(statement.modifiers[0]) > 0 else 0
+        y = statement.modifiers[0][1] \
+            if len(statement.modifiers[0]) > 1 else 0
+        return names[LANDSCAPE_OBROUND] if x > y else names[PORTRATE_OBROUND]
+    elif statement.shape == 'P':
+        return names[POLYGON]
+    return statement.shape
+
+class _StreamRotator(object):
+    def __init__(self, context):
+        self.context = context
+        self.angle = context.angle
+        self.macro_names = set()
+        self.generic_names = None
+
+    def rotate(self, type, statement):
+        if type == self.context.TYPE_AM:
+            self.macro_names.add(statement.name)
+            statement.rotate(self.angle)
+        elif type == self.context.TYPE_AD:
+            if statement.shape in GENERIC_SHAPES:
+                if self.generic_names is None:
+                    self.generic_names = _generic_macro_names(self.macro_names)
+                    for name, factory in zip(self.generic_names, GENERIC_MACROS):
+                        macro = factory(name, self.context.units)
+                        macro.rotate(self.angle)
+                        yield (self.context.TYPE_AM, macro)
+                statement.shape = _generic_shape(statement, self.generic_names)
+        elif isinstance(statement, CoordStmt) and \
+             statement.x is not None and statement.y is not None:
+            if statement.i is not None and statement.j is not None:
+                statement.i, statement.j = \
+                    rotate(statement.i, statement.j, self.angle, (0, 0))
+            statement.x, statement.y = \
+                rotate(statement.x, statement.y, self.angle, (0, 0))
+        yield (type, statement)
 
 class GerberContext(FileSettings):
     TYPE_NONE = 'none'
@@ -243,6 +684,12 @@ class GerberContext(FileSettings):
             self._update_matrix()
         elif isinstance(stmt, IRParamStmt):
             self.angle = stmt.angle
+        elif isinstance(stmt, FSParamStmt):
+            self.notation = stmt.notation
+            self.zero_suppression = stmt.zero_suppression
+            self.format = stmt.format
+        elif isinstance(stmt, MOParamStmt):
+            self.units = stmt.mode
         elif isinstance(stmt, AMParamStmt) and not isinstance(stmt, AMParamStmtEx):
             stmt = AMParamStmtEx.from_stmt(stmt)
             return (self.TYPE_AM, [stmt])
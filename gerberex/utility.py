@@ -3,7 +3,9 @@
 
 # Copyright 2019 Hiroshi Murayama <opiopan@gmail.com>
 
-from math import cos, sin, pi, sqrt
+from math import cos, sin, pi, sqrt, radians
+
+ENCODING = 'utf-8'
 
 def rotate(x, y, angle, center):
     x0 = x - center[0]
@@ -24,4 +26,105 @@ def normalize_vec2d(vec):
     return (vec[0] / length, vec[1] / length)
 
 def dot_vec2d(vec1, vec2):
-    return vec1[0] * vec2[0] + vec1[1] * vec2[1]
\ No newline at end of file
+    return vec1[0] * vec2[0] + vec1[1] * vec2[1]
+
+def value_formatter(format=(2, 5), zero_suppression='trailing'):
+    # returns a function which has same result as gerber.utils.write_gerber_value().
+    # digits are taken from one printf style conversion, so rounding is same
+    integer_digits, decimal_digits = format
+    max_digits = integer_digits + decimal_digits
+    if max_digits > 13 or integer_digits > 6 or decimal_digits > 7:
+        raise ValueError('Parser only supports precision up to 6:7 format')
+    conversion = '%%.%df' % decimal_digits
+    width = max_digits if decimal_digits > 0 else max_digits + 1
+
+    def format_value(value):
+        if value == 0:
+            return '0'
+        negative = value < 0
+        digits = (conversion % (-value if negative else value)).replace('.', '')
+        if not digits.strip('0'):
+            return '0'
+        if zero_suppression == 'trailing':
+            digits = digits.zfill(width).rstrip('0')
+        elif zero_suppression == 'leading':
+            digits = digits.lstrip('0')
+        else:
+            digits = digits.zfill(width)
+        return '-' + digits if negative else digits
+    return format_value
+
+def shallow_copy(obj):
+    # faster equivalent of copy.copy() for plain objects such as statements
+    new = object.__new__(obj.__class__)
+    new.__dict__.update(obj.__dict__)
+    return new
+
+def cos_sin(angle):
+    # multiples of right angle are calculated exactly
+    quarter, remainder = divmod(angle, 90)
+    if remainder == 0:
+        return ((1., 0.), (0., 1.), (-1., 0.), (0., -1.))[int(quarter) % 4]
+    angle = radians(angle)
+    return (cos(angle), sin(angle))
+
+class Transform(object):
+    # immutable 2D affine transform, x' = a * x + b * y + e, y' = c * x + d * y + f.
+    # linear part of matrix is always scale * rotation(angle) * (y axis mirroring
+    # if mirrored), so that arcs and apertures can be transformed also.
+    IDENTITY = (1., 0., 0., 1., 0., 0.)
+
+    def __init__(self, matrix=IDENTITY, angle=0., scale=1., mirrored=False):
+        self.matrix = matrix
+        self.angle = angle
+        self.scale = scale
+        self.mirrored = mirrored
+
+    @property
+    def is_identity(self):
+        return self.matrix == self.IDENTITY
+
+    def rotated(self, angle, center=(0, 0)):
+        c, s = cos_sin(angle)
+        cx, cy = center
+        return self._then((c, -s, s, c, cx - c * cx + s * cy, cy - s * cx - c * cy),
+                          angle, 1., False)
+
+    def translated(self, x_offset, y_offset):
+        return self._then((1., 0., 0., 1., x_offset, y_offset), 0., 1., False)
+
+    def scaled(self, factor):
+        return self._then((factor, 0., 0., factor, 0., 0.), 0., factor, False)
+
+    def mirrored_by(self, x=True, y=False, center=(0, 0)):
+        # x: negate x coordinates, y: negate y coordinates
+        if not x and not y:
+            return self
+        mx = -1. if x else 1.
+        my = -1. if y else 1.
+        matrix = (mx, 0., 0., my,
+                  2. * center[0] if x else 0., 2. * center[1] if y else 0.)
+        return self._then(matrix, 180. if x else 0., 1., x != y)
+
+    def point(self, x, y):
+        a, b, c, d, e, f = self.matrix
+        return (a * x + b * y + e, c * x + d * y + f)
+
+    def vector(self, x, y):
+        a, b, c, d, e, f = self.matrix
+        return (a * x + b * y, c * x + d * y)
+
+    def direction(self, angle):
+        # transform direction angle in degrees
+        return self.angle + (-angle if self.mirrored else angle)
+
+    def _then(self, matrix, angle, scale, mirrored):
+        a0, b0, c0, d0, e0, f0 = self.matrix
+        a1, b1, c1, d1, e1, f1 = matrix
+        return Transform(
+            (a1 * a0 + b1 * c0, a1 * b0 + b1 * d0,
+             c1 * a0 + d1 * c0, c1 * b0 + d1 * d0,
+             a1 * e0 + b1 * f0 + e1, c1 * e0 + d1 * f0 + f1),
+            angle + (-self.angle if mirrored else self.angle),
+            scale * self.scale,
+            mirrored != self.mirrored)
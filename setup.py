@@ -36,6 +36,10 @@ METADATA = {
 
 SETUPTOOLS_METADATA = {
     'install_requires': ['pcb-tools', 'dxfgrabber'],
+    'extras_require': {'numpy': ['numpy']},
+    'entry_points': {
+        'console_scripts': ['gerberex-panelize=gerberex.cli:main'],
+    },
 }
 
 
@@ -0,0 +1,82 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# Copyright 2019 Hiroshi Murayama <opiopan@gmail.com>
+
+import os
+import shutil
+import unittest
+from unittest import mock
+import gerberex
+
+
+class TestCache(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        os.chdir(os.path.dirname(__file__))
+        cls.INDIR = 'data'
+        cls.OUTDIR = 'outputs'
+        cls.EXPECTSDIR = 'expects'
+        cls.CACHEDIR = os.path.join(cls.OUTDIR, 'cache')
+        try:
+            os.mkdir(cls.OUTDIR)
+        except FileExistsError:
+            pass
+
+    def setUp(self):
+        shutil.rmtree(self.CACHEDIR, ignore_errors=True)
+
+    def _checkResult(self, file, expect):
+        with open(file, 'r') as f:
+            data = f.read()
+        with open(os.path.join(self.EXPECTSDIR, expect), 'r') as f:
+            expect = f.read()
+        self.assertEqual(data, expect)
+
+    def test_read(self):
+        cases = (
+            ('ref_gerber_metric.gtl', 'RS2724x_save.gtl'),
+            ('ref_drill_metric.txt', 'excellon_save.txt'),
+            ('ref_dxf_metric.dxf', 'dxf_save_line.gtl'),
+        )
+        cache = gerberex.FileCache(self.CACHEDIR)
+        for name, expect in cases:
+            path = os.path.join(self.INDIR, name)
+            key = cache.key(open(path, 'rb').read(), name.endswith('.dxf'), None, False)
+            for n in range(2):
+                self.assertEqual(cache.load(key) is not None, n > 0)
+                file = gerberex.read(path, cache=self.CACHEDIR)
+                self.assertEqual(file.filename, path)
+                if name.endswith('.dxf'):
+                    file.width = 0.2
+                outfile = os.path.join(self.OUTDIR, 'cache_' + expect)
+                file.write(outfile)
+                self._checkResult(outfile, expect)
+
+    def test_evict(self):
+        cache = gerberex.FileCache(self.CACHEDIR, max_size=0)
+        cache.store('a', [1])
+        self.assertIsNone(cache.load('a'))
+        cache.max_size = 1024
+        cache.store('a', [1])
+        cache.store('b', [2])
+        os.utime(cache._path('a'), (0, 0))
+        cache.max_size = os.path.getsize(cache._path('b'))
+        cache.evict()
+        self.assertIsNone(cache.load('a'))
+        self.assertEqual(cache.load('b'), [2])
+
+    def test_load_evicted(self):
+        # entry is removed by other process between loading and touching it
+        cache = gerberex.FileCache(self.CACHEDIR)
+        cache.store('a', [1])
+        load = gerberex.cache.pickle.load
+        def load_and_remove(f):
+            os.remove(cache._path('a'))
+            return load(f)
+        with mock.patch.object(gerberex.cache.pickle, 'load', load_and_remove):
+            self.assertEqual(cache.load('a'), [1])
+        self.assertIsNone(cache.load('a'))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,311 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# Copyright 2019 Hiroshi Murayama <opiopan@gmail.com>
+
+import os
+import json
+import unittest
+import gerberex
+import gerberex.cli
+import gerberex.instrument as instrument
+from gerberex import GerberComposition, DrillComposition, MergeJob, PanelBuilder
+from gerberex.panel import build_layer
+
+
+class TestComposition(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        os.chdir(os.path.dirname(__file__))
+        cls.INDIR = 'data'
+        cls.OUTDIR = 'outputs'
+        cls.EXPECTSDIR = 'expects'
+        cls.OUTPREFIX = 'composition_'
+        cls.GERBER_FILE = os.path.join(cls.INDIR, 'ref_gerber_inch.gtl')
+        cls.DRILL_FILE = os.path.join(cls.INDIR, 'ref_drill_inch.txt')
+        cls.DXF_FILE = os.path.join(cls.INDIR, 'ref_dxf_metric.dxf')
+        try:
+            os.mkdir(cls.OUTDIR)
+        except FileExistsError:
+            pass
+
+    def _read(self, path):
+        with open(path, 'r') as f:
+            return f.read()
+
+    def _compose(self, ctx, files, name):
+        for n, file in enumerate(files):
+            file.to_metric()
+            file.rotate(30 * n)
+            file.offset(10 * n, 5 * n)
+            ctx.merge(file)
+        outfile = os.path.join(self.OUTDIR, self.OUTPREFIX + name)
+        ctx.dump(outfile)
+        return self._read(outfile)
+
+    def _write(self, file, name):
+        outfile = os.path.join(self.OUTDIR, self.OUTPREFIX + name)
+        if isinstance(file, (GerberComposition, DrillComposition)):
+            file.dump(outfile)
+        else:
+            file.write(outfile)
+        return self._read(outfile)
+
+    def _check_clone(self, path, new_composition, name):
+        source = gerberex.read(path)
+        cloned = self._compose(
+            new_composition(), [source.clone() for n in range(3)], 'clone_' + name)
+        separated = self._compose(
+            new_composition(), [gerberex.read(path) for n in range(3)], name)
+        self.assertEqual(cloned, separated)
+        self.assertEqual(self._write(source, 'source_' + name),
+                         self._write(gerberex.read(path), 'reread_' + name))
+
+    def test_gerber_clone(self):
+        self._check_clone(self.GERBER_FILE, GerberComposition, 'gerber.gtl')
+
+    def test_drill_clone(self):
+        self._check_clone(self.DRILL_FILE, DrillComposition, 'drill.txt')
+
+    def test_merge_keeps_source(self):
+        gerber = gerberex.read(self.GERBER_FILE)
+        expect = gerberex.read(self.GERBER_FILE)
+        ctx = GerberComposition()
+        ctx.merge(gerberex.rectangle(10, 10))
+        ctx.merge(gerber)
+        ctx.merge(gerber)
+        self.assertEqual(gerber.units, 'inch')
+        self.assertEqual([s.to_gerber(gerber.context) for s in gerber.main_statements],
+                         [s.to_gerber(expect.context) for s in expect.main_statements])
+        self.assertEqual([s.to_gerber(gerber.context) for s in gerber.aperture_defs],
+                         [s.to_gerber(expect.context) for s in expect.aperture_defs])
+
+        dxf = gerberex.read(self.DXF_FILE)
+        dcode = dxf.aperture.d
+        ctx.merge(dxf)
+        self.assertEqual(dxf.aperture.d, dcode)
+        self.assertEqual(dxf.statements.dcode, dcode)
+
+    def test_merge_then_transform(self):
+        # transforming a file after merge doesn't affect placement merged before
+        for path, new_composition, name in (
+                (self.GERBER_FILE, GerberComposition, 'gerber.gtl'),
+                (self.DRILL_FILE, DrillComposition, 'drill.txt')):
+            reused = new_composition()
+            file = gerberex.read(path)
+            reused.merge(file)
+            file.rotate(90)
+            file.offset(30, 0)
+            reused.merge(file)
+            separated = new_composition()
+            separated.merge(gerberex.read(path))
+            file = gerberex.read(path)
+            file.rotate(90)
+            file.offset(30, 0)
+            separated.merge(file)
+            self.assertEqual(self._write(reused, 'reused_' + name),
+                             self._write(separated, 'separated_' + name))
+
+    def test_mirror(self):
+        for path in (self.GERBER_FILE, self.DRILL_FILE, self.DXF_FILE):
+            name = os.path.basename(path)
+            mirrored = gerberex.read(path)
+            mirrored.mirror(True, False, (3, 1))
+            mirrored.mirror(True, False, (3, 1))
+            mirrored.mirror(True, True, (1, 2))
+            rotated = gerberex.read(path)
+            rotated.rotate(180, (1, 2))
+            if name.endswith('.gtl'):
+                # rotation generalizes apertures, so compare drawing part only
+                self.assertEqual(
+                    [s.to_gerber(mirrored.context) for s in mirrored.main_statements],
+                    [s.to_gerber(rotated.context) for s in rotated.main_statements])
+                continue
+            if name.endswith('.dxf'):
+                mirrored.width = rotated.width = 0.2
+            self.assertEqual(self._write(mirrored, 'mirror_' + name),
+                             self._write(rotated, 'rotate_' + name))
+
+    def test_merge_many(self):
+        def serial(ctx, jobs):
+            for path, x_offset, y_offset, angle, units in jobs:
+                file = gerberex.read(path)
+                if units == 'metric':
+                    file.to_metric()
+                file.rotate(angle)
+                file.offset(x_offset, y_offset)
+                ctx.merge(file)
+            return ctx
+        cases = (
+            (GerberComposition, 'merge_many.gtl',
+             [(self.GERBER_FILE, 0, 0, 0, 'metric'), (self.DXF_FILE, 10, 0, 0, None),
+              (self.GERBER_FILE, 10, 5, 30, 'metric')]),
+            (DrillComposition, 'merge_many.txt',
+             [(self.DRILL_FILE, 0, 0, 0, 'metric'),
+              (os.path.join(self.INDIR, 'ref_drill_metric.txt'), 10, 5, 90, None)]),
+        )
+        for new_composition, name, jobs in cases:
+            expect = self._write(serial(new_composition(), jobs), 'serial_' + name)
+            ctx = new_composition()
+            ctx.merge_many([MergeJob(p, x, y, a, u) for p, x, y, a, u in jobs], workers=2)
+            self.assertEqual(self._write(ctx, name), expect)
+
+    def test_panel_builder(self):
+        boards = {
+            'a': {'gtl': self.GERBER_FILE, 'txt': self.DRILL_FILE},
+            'b': {'gtl': self.GERBER_FILE},
+        }
+        placements = [('a', 0, 0, 0), ('b', 10, 5, 30), ('a', 20, 0, 90)]
+        extras = {'gtl': [MergeJob(self.DXF_FILE)]}
+        outputs = dict((layer, os.path.join(self.OUTDIR, self.OUTPREFIX + 'panel.' + layer))
+                       for layer in ('gtl', 'txt'))
+        builder = PanelBuilder(boards, placements, extras, workers=2)
+        self.assertEqual(sorted(builder.build(outputs)), ['gtl', 'txt'])
+        for layer, new_composition in (('gtl', GerberComposition), ('txt', DrillComposition)):
+            ctx = new_composition()
+            for name, x_offset, y_offset, angle in placements:
+                if layer in boards[name]:
+                    file = gerberex.read(boards[name][layer])
+                    file.to_metric()
+                    file.rotate(angle)
+                    file.offset(x_offset, y_offset)
+                    ctx.merge(file)
+            for job in extras.get(layer, []):
+                ctx.merge(gerberex.read(job.path))
+            self.assertEqual(self._read(outputs[layer]),
+                             self._write(ctx, 'panel_serial.' + layer))
+
+    def test_panel_extras_only(self):
+        # drill layer made only of extras is drill data, and extras are cached
+        cache = gerberex.FileCache(os.path.join(self.OUTDIR, 'composition_cache'))
+        cache.clear()
+        outfile = os.path.join(self.OUTDIR, self.OUTPREFIX + 'extras.txt')
+        build_layer('txt', [], [MergeJob(self.DRILL_FILE, 10, 5)], outfile, None, cache)
+        ctx = DrillComposition()
+        drill = gerberex.read(self.DRILL_FILE)
+        drill.offset(10, 5)
+        ctx.merge(drill)
+        self.assertEqual(self._read(outfile), self._write(ctx, 'extras_expect.txt'))
+        with open(self.DRILL_FILE, 'rb') as f:
+            key = cache.key(f.read(), False, None, True)
+        self.assertIsNotNone(cache.load(key))
+
+    def test_panel_spec(self):
+        # paths in spec are relative to directory of spec file
+        spec = {
+            'layers': ['gtl', 'txt'],
+            'boards': {'a': {'gtl': '../' + self.GERBER_FILE, 'txt': '../' + self.DRILL_FILE}},
+            'placements': [['a'], {'board': 'a', 'x': 10, 'y': 5, 'angle': 30}],
+            'extras': [{'path': '../data/ref_dxf_metric.dxf', 'layers': ['gtl'], 'width': 0.2}],
+            'output': self.OUTPREFIX + 'spec',
+        }
+        path = os.path.join(self.OUTDIR, self.OUTPREFIX + 'spec.json')
+        with open(path, 'w') as f:
+            json.dump(spec, f)
+        gerberex.cli.main(['-q', '-j', '1', path])
+
+        boards = {'a': {'gtl': self.GERBER_FILE, 'txt': self.DRILL_FILE}}
+        placements = [('a', 0, 0, 0), ('a', 10, 5, 30)]
+        extras = {'gtl': [MergeJob(self.DXF_FILE, attributes={'width': 0.2})]}
+        PanelBuilder(boards, placements, extras, workers=1).build(
+            lambda layer: os.path.join(self.OUTDIR, self.OUTPREFIX + 'spec_expect.' + layer))
+        for layer in spec['layers']:
+            self.assertEqual(
+                self._read(os.path.join(self.OUTDIR, self.OUTPREFIX + 'spec.' + layer)),
+                self._read(os.path.join(self.OUTDIR, self.OUTPREFIX + 'spec_expect.' + layer)))
+
+    def test_instrument(self):
+        self.assertFalse(instrument.enabled())
+        with instrument.recording() as report:
+            ctx = GerberComposition()
+            gerber = gerberex.read(self.GERBER_FILE)
+            gerber.rotate(30)
+            ctx.merge(gerber)
+            ctx.merge(gerberex.read(self.DXF_FILE))
+            outfile = os.path.join(self.OUTDIR, self.OUTPREFIX + 'instrument.gtl')
+            ctx.dump(outfile)
+        self.assertFalse(instrument.enabled())
+        data = report.to_dict()
+        for name in ('parse', 'rs274x.normalize_statement', 'rs274x.generalize_aperture',
+                     'dxf.generate_paths', 'gerber.merge', 'gerber.dump'):
+            self.assertIn(name, data['phases'])
+        self.assertEqual(data['phases']['parse']['calls'], 2)
+        self.assertEqual(sum(data['statements'][self.DXF_FILE].values()),
+                         len(gerberex.read(self.DXF_FILE).statements.statements))
+        self.assertEqual(sorted(data['bytes_written']), sorted([self.GERBER_FILE, self.DXF_FILE]))
+        self.assertLess(sum(data['bytes_written'].values()), data['outputs'][outfile])
+        self.assertEqual(data['outputs'][outfile], os.path.getsize(outfile))
+
+    def test_aperture_dedup(self):
+        gerber = gerberex.read(self.GERBER_FILE)
+        gerber.to_metric()
+        ctx = GerberComposition()
+        ctx.merge(gerber)
+        for n in range(3):
+            copy = gerber.clone()
+            copy.offset(10 * n, 0)
+            ctx.merge(copy)
+        copy = gerber.clone()
+        copy.rotate(90)
+        ctx.merge(copy)
+        # circles are not changed by rotation
+        circles = [s for s in gerber.aperture_defs if s.shape == 'C']
+        self.assertEqual(len(ctx.apertures), 2 * len(gerber.aperture_defs) - len(circles))
+        outfile = os.path.join(self.OUTDIR, self.OUTPREFIX + 'dedup.gtl')
+        ctx.dump(outfile)
+        header = [l for l in self._read(outfile).split('\n') if l.startswith('%AD')]
+        self.assertEqual(len(header), len(set(l[l.index('D', 3) + 3:] for l in header)))
+
+    def test_tool_registry(self):
+        drill = gerberex.read(os.path.join(self.INDIR, 'ref_drill_metric.txt'))
+        converted = drill.clone()
+        converted.to_inch()
+        converted.to_metric()
+        ctx = DrillComposition()
+        ctx.merge(drill)
+        ctx.merge(converted)
+        ctx.merge(gerberex.read(self.DXF_FILE))
+        self.assertEqual([t.number for t in ctx.tools], list(range(1, len(drill.tools) + 2)))
+        # hits of each merged file are kept with its tool map
+        self.assertEqual(len(ctx.hits), 2)
+        for tool in drill.tools.values():
+            merged = [h for tool_map, hits in ctx.hits for h in hits
+                      if tool_map[h.tool.number].number == tool.number]
+            self.assertEqual(len(merged), 2 * len([h for h in drill.hits if h.tool is tool]))
+        self.assertEqual([num for num, statements in ctx.dxf_statements], [len(drill.tools) + 1])
+
+    def test_spill(self):
+        def compose(name, memory_budget):
+            ctx = GerberComposition(memory_budget=memory_budget)
+            files = [gerberex.read(self.GERBER_FILE) for n in range(3)]
+            files.insert(1, gerberex.read(self.DXF_FILE))
+            result = self._compose(ctx, files, name)
+            return result, [type(d).__name__ for d in ctx.drawings]
+        expect, drawings = compose('spill_none.gtl', None)
+        self.assertNotIn('SpilledDrawing', drawings)
+        result, drawings = compose('spill_all.gtl', 0)
+        self.assertEqual(result, expect)
+        self.assertEqual(drawings, ['SpilledDrawing'] * 4)
+        budget = 2 * 44 * GerberComposition.STATEMENT_SIZE
+        result, drawings = compose('spill_partial.gtl', budget)
+        self.assertEqual(result, expect)
+        self.assertEqual(drawings[-1], 'GerberDrawing')
+        self.assertIn('SpilledDrawing', drawings)
+
+    def test_spill_bytes_written(self):
+        # spilled drawings are counted once, when they are copied to output
+        def record(name, memory_budget):
+            with instrument.recording() as report:
+                ctx = GerberComposition(memory_budget=memory_budget)
+                self._compose(ctx, [gerberex.read(self.GERBER_FILE),
+                                    gerberex.read(self.DXF_FILE)], name)
+            return report.to_dict()['bytes_written'], ctx
+        expect, ctx = record('bytes_none.gtl', None)
+        self.assertEqual(sorted(expect), sorted([self.GERBER_FILE, self.DXF_FILE]))
+        result, ctx = record('bytes_spill.gtl', 1)
+        self.assertEqual([type(d).__name__ for d in ctx.drawings], ['SpilledDrawing'] * 2)
+        self.assertEqual(result, expect)
+        self.assertEqual(sum(result.values()), sum(d.size for d in ctx.drawings))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -4,9 +4,14 @@
 # Copyright 2019 Hiroshi Murayama <opiopan@gmail.com>
 
 import os
+import math
+import random
 import unittest
 import gerberex
 from gerber.utils import inch, metric
+from gerberex.dxf import DxfLineStatement, DxfArcStatement, _Entity
+from gerberex.dxf_path import generate_paths, colliding_pairs, judge_containment, DxfPath
+from gerberex.columns import is_available as is_columns_available
 
 
 class TestExcellon(unittest.TestCase):
@@ -149,5 +154,128 @@ class TestExcellon(unittest.TestCase):
         ctx.dump(outfile)
         self._checkResult(outfile)
 
+    def test_generate_paths(self):
+        # octagon split into segments in random order and direction, end points
+        # are shifted within error range, and an open chain.
+        # some segments are duplicated
+        rand = random.Random(0)
+        points = [(10, 0), (20, 0), (30, 10), (30, 20), (20, 30), (10, 30), (0, 20), (0, 10)]
+        segments = list(zip(points, points[1:] + points[:1]))
+        segments += [((50, 0), (60, 0)), ((60, 0), (60, 10)), ((60, 10), (70, 20))]
+        statements = []
+        for start, end in segments:
+            end = (end[0] + rand.uniform(-0.0005, 0.0005), end[1])
+            if rand.random() < 0.5:
+                start, end = end, start
+            statements.append(DxfLineStatement(None, start, end))
+        for statement in statements[::3]:
+            statements.append(DxfLineStatement(
+                None, statement.end, (statement.start[0] + 0.0005, statement.start[1])))
+        rand.shuffle(statements)
+        closed, opened = generate_paths(statements, 0.001)
+        self.assertEqual([len(path.statements) for path in closed], [8])
+        self.assertEqual([len(path.statements) for path in opened], [3])
+        for path in closed + opened:
+            for prev, next in zip(path.statements, path.statements[1:]):
+                self.assertLessEqual(abs(prev.end[0] - next.start[0]), 0.001)
+                self.assertEqual(prev.end[1], next.start[1])
+
+    def test_generate_paths_with_near_ends(self):
+        # open paths whose start and end are in same cell of the grid, an arc
+        # whose end points are within error range and a chain whose end points
+        # are slightly farther than error range
+        entity = _Entity()
+        entity.dxftype = 'ARC'
+        entity.center = (100, 100)
+        entity.radius = 1
+        entity.start_angle = 10
+        entity.end_angle = 369.99
+        chain = [DxfLineStatement(None, (0, 0), (10, 0)),
+                 DxfLineStatement(None, (10, 0), (5, 5)),
+                 DxfLineStatement(None, (5, 5), (0.0010000005, 0))]
+        closed, opened = generate_paths([DxfArcStatement(entity)] + chain, 0.001)
+        self.assertEqual(len(closed), 0)
+        self.assertEqual(sorted(len(path.statements) for path in opened), [1, 3])
+
+    def test_colliding_pairs(self):
+        rand = random.Random(0)
+        paths = []
+        for n in range(200):
+            x, y = rand.uniform(0, 100), rand.uniform(0, 100)
+            width, height = rand.choice([0, 1, 5, 20]), rand.choice([0, 1, 5, 20])
+            paths.append(DxfPath([DxfLineStatement(None, (x, y), (x + width, y + height))]))
+        expect = [(i, j) for i in range(len(paths)) for j in range(i + 1, len(paths))
+                  if paths[i].may_be_in_collision(paths[j])]
+        self.assertEqual(colliding_pairs(paths), expect)
+
+    def test_judge_containment(self):
+        def polygon(x, y, radius, num):
+            points = [(x + radius * math.cos(2 * math.pi * n / num),
+                       y + radius * math.sin(2 * math.pi * n / num)) for n in range(num)]
+            return DxfPath([DxfLineStatement(None, points[n - 1], points[n])
+                            for n in range(num)])
+        def circle(x, y, radius):
+            entity = _Entity()
+            entity.dxftype = 'CIRCLE'
+            entity.center = (x, y)
+            entity.radius = radius
+            return DxfPath([DxfArcStatement(entity)])
+        outline = polygon(50, 50, 40, 64)
+        inner = polygon(50, 50, 10, 32)
+        self.assertEqual(judge_containment(inner, outline, 0.001), [inner, outline])
+        self.assertEqual(judge_containment(outline, inner, 0.001), [inner, outline])
+        hole = circle(30, 50, 5)
+        self.assertEqual(judge_containment(hole, outline, 0.001), [hole, outline])
+        self.assertEqual(judge_containment(circle(90, 50, 5), outline, 0.001), (None, None))
+        self.assertEqual(judge_containment(circle(14, 14, 3), outline, 0.001), (None, None))
+        outline.offset(0, 40)
+        self.assertEqual(judge_containment(hole, outline, 0.001), (None, None))
+
+    def test_comb_containment(self):
+        # teeth span whole height, yet a probe looks up only edges around it
+        teeth = 500
+        points = [(0, -5)]
+        for n in range(teeth):
+            points += [(2 * n, 0), (2 * n, 50), (2 * n + 1, 50), (2 * n + 1, 0)]
+        points += [(2 * teeth, 0), (2 * teeth, -5)]
+        outline = DxfPath([DxfLineStatement(None, points[n - 1], points[n])
+                           for n in range(len(points))])
+        table = outline.edge_table(0.001)
+        for n in (0, 123, teeth - 1):
+            self.assertTrue(table.contains((2 * n + 0.5, 25)))
+            self.assertFalse(table.contains((2 * n + 1.5, 25)))
+            self.assertTrue(table.is_clear((2 * n + 0.5, 10), (2 * n + 0.5, 40)))
+            self.assertFalse(table.is_clear((2 * n + 0.5, 10), (2 * n + 1.5, 10)))
+            examined = sum(last - first for first, last in
+                           table._buckets_in(2 * n + 0.5, 10, 2 * n + 0.5, 40))
+            self.assertLess(examined, len(table.edges) // 50)
+        hole = DxfPath([DxfLineStatement(None, (246.3, 20), (246.7, 20)),
+                        DxfLineStatement(None, (246.7, 20), (246.7, 30)),
+                        DxfLineStatement(None, (246.7, 30), (246.3, 30)),
+                        DxfLineStatement(None, (246.3, 30), (246.3, 20))])
+        self.assertEqual(judge_containment(hole, outline, 0.001), [hole, outline])
+        hole.offset(1, 0)
+        self.assertEqual(judge_containment(hole, outline, 0.001), (None, None))
+
+    def test_dots(self):
+        if not is_columns_available():
+            self.skipTest('numpy is not installed')
+        def arc(x, y, radius, start_angle, end_angle):
+            entity = _Entity()
+            entity.dxftype = 'ARC'
+            entity.center = (x, y)
+            entity.radius = radius
+            entity.start_angle = start_angle
+            entity.end_angle = end_angle
+            return DxfArcStatement(entity)
+        slot = DxfPath([DxfLineStatement(None, (0, 0), (10, 0)), arc(10, 1, 1, 270, 450),
+                        DxfLineStatement(None, (10, 2), (0.3, 2)), arc(0, 1, 1, 90, 270)])
+        rail = DxfPath([DxfLineStatement(None, (0, 5), (7.3, 5)),
+                        DxfLineStatement(None, (7.3, 5), (7.5, 5)), arc(7.5, 7, 2, 270, 360)])
+        for path in (slot, rail):
+            for pitch, width in ((1, 0.5), (0.7, 0), (3, 1)):
+                x, y = path.dots(pitch, width)
+                self.assertEqual((x.tolist(), y.tolist()), path._scalar_dots(pitch, width))
+
 if __name__ == '__main__':
     unittest.main()
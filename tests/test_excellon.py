@@ -6,6 +6,8 @@
 import os
 import unittest
 import gerberex
+import gerber.excellon
+from gerber.excellon_statements import CoordinateStmt, UnitStmt
 
 
 class TestExcellon(unittest.TestCase):
@@ -37,6 +39,39 @@ class TestExcellon(unittest.TestCase):
         drill.write(outfile)
         self._checkResult(outfile)
 
+    def test_loads_bytes(self):
+        outfile = os.path.join(self.OUTDIR, self.OUTPREFIX + 'save.txt')
+        with open(self.METRIC_FILE, 'rb') as f:
+            data = f.read()
+        drill = gerberex.loads(memoryview(data), self.METRIC_FILE)
+        drill.write(outfile)
+        self._checkResult(outfile)
+
+    def test_no_global_patch(self):
+        gerberex.read(self.METRIC_FILE)
+        self.assertIs(gerber.excellon.CoordinateStmt, CoordinateStmt)
+        self.assertIs(gerber.excellon.UnitStmt, UnitStmt)
+
+    def test_extended_statements(self):
+        parser = gerberex.excellon.ExcellonParserEx()
+        for line in ('M48', 'METRIC,TZ', 'T1C1.0', '%', 'T1', 'G00X1.0Y1.0', 'M15',
+                     'G01X2.0', 'X2.0Y2.0A1.0', 'M16'):
+            parser._parse_line(line)
+        self.assertIsInstance(parser.statements[1], gerberex.excellon.UnitStmtEx)
+        coords = [s for s in parser.statements if isinstance(s, CoordinateStmt)]
+        self.assertEqual(len(coords), 3)
+        self.assertTrue(all(isinstance(s, gerberex.excellon.CoordinateStmtEx) for s in coords))
+        self.assertEqual(coords[2].radius, 1.0)
+        self.assertEqual([hit.end for hit in parser.hits], [(2.0, 1.0), (2.0, 2.0)])
+
+    def test_detect_format_by_trial(self):
+        with open(self.METRIC_FILE, 'r') as f:
+            data = f.read()
+        format = gerberex.excellon._detect_excellon_format(data)
+        data = '\n'.join([line for line in data.splitlines()
+                          if 'FILE_FORMAT' not in line and 'METRIC' not in line])
+        self.assertEqual(gerberex.excellon._detect_excellon_format(data), format)
+
     def test_to_inch(self):
         outfile = os.path.join(self.OUTDIR, self.OUTPREFIX + 'to_inch.txt')
         drill = gerberex.read(self.METRIC_FILE)
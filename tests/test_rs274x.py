@@ -6,6 +6,12 @@
 import os
 import unittest
 import gerberex
+import gerberex.rs274x
+import gerber.rs274x
+from gerber.utils import parse_gerber_value, write_gerber_value
+from gerber.gerber_statements import CoordStmt
+from gerberex.utility import value_formatter
+from gerberex.columns import format_column, numpy
 
 class TestRs274x(unittest.TestCase):
     @classmethod
@@ -72,5 +78,130 @@ class TestRs274x(unittest.TestCase):
         gerber.write(outfile)
         self._checkResult(outfile)
 
+    def test_loads_bytes(self):
+        outfile = os.path.join(self.OUTDIR, self.OUTPREFIX + 'save.gtl')
+        with open(self.METRIC_FILE, 'rb') as f:
+            data = f.read()
+        for source in (data, memoryview(data)):
+            gerber = gerberex.loads(source, self.METRIC_FILE)
+            gerber.write(outfile)
+            self._checkResult(outfile)
+
+    def test_read_mmap(self):
+        outfile = os.path.join(self.OUTDIR, self.OUTPREFIX + 'save.gtl')
+        threshold = gerberex.common.MMAP_THRESHOLD
+        gerberex.common.MMAP_THRESHOLD = 0
+        try:
+            gerber = gerberex.read(self.METRIC_FILE)
+        finally:
+            gerberex.common.MMAP_THRESHOLD = threshold
+        gerber.write(outfile)
+        self._checkResult(outfile)
+
+    def test_concurrent_parse(self):
+        from concurrent.futures import ThreadPoolExecutor
+        with open(self.METRIC_FILE, 'r') as f:
+            data = f.read()
+        def parse(n):
+            file = gerberex.loads(data, self.METRIC_FILE)
+            return [s.to_gerber(file.context) for s in file.main_statements]
+        expect = parse(0)
+        with ThreadPoolExecutor(max_workers=4) as executor:
+            for result in executor.map(parse, range(16)):
+                self.assertEqual(result, expect)
+        self.assertIsNot(gerber.rs274x.GerberParser.SF, gerberex.rs274x.GerberParser.SF)
+
+    def test_iter_gerber(self):
+        for path in (self.METRIC_FILE, self.INCH_FILE, self.SQ_FILE):
+            gerber = gerberex.read(path)
+            context = gerberex.rs274x.GerberContext()
+            macros, apertures, drawings = [], [], []
+            for type, statement in gerberex.iter_gerber(path, context, chunk_size=7):
+                if type == context.TYPE_AM:
+                    macros.append(statement.to_gerber(context))
+                elif type == context.TYPE_AD:
+                    apertures.append(statement.to_gerber(context))
+                else:
+                    drawings.append(statement.to_gerber(context))
+            self.assertEqual(context.units, gerber.units)
+            self.assertEqual(
+                macros,
+                [gerber.aperture_macros[m].to_gerber(context) for m in gerber.aperture_macros])
+            self.assertEqual(
+                apertures, [s.to_gerber(context) for s in gerber.aperture_defs])
+            self.assertEqual(
+                drawings, [s.to_gerber(context) for s in gerber.main_statements])
+
+    def test_lean(self):
+        outfile = os.path.join(self.OUTDIR, self.OUTPREFIX + 'to_inch.gtl')
+        gerber = gerberex.read(self.METRIC_FILE, lean=True)
+        self.assertEqual(gerber.statements, [])
+        self.assertEqual(gerber.primitives, [])
+        gerber.to_inch()
+        gerber.format = (2,5)
+        gerber.write(outfile)
+        self._checkResult(outfile)
+
+    def test_columns(self):
+        if not gerberex.rs274x.is_columns_available():
+            self.skipTest('numpy is not installed')
+        outfile = os.path.join(self.OUTDIR, self.OUTPREFIX + 'rotate.gtl')
+        gerber = gerberex.read(self.METRIC_FILE)
+        columns = gerber.columns
+        self.assertEqual(len(columns), len(
+            [s for s in gerber.main_statements if isinstance(s, CoordStmt)]))
+        clone = gerber.clone()
+        gerber.rotate(20, (10,10))
+        self.assertIsNot(gerber.columns, columns)
+        gerber.write(outfile)
+        self._checkResult(outfile)
+
+        outfile = os.path.join(self.OUTDIR, self.OUTPREFIX + 'save.gtl')
+        clone.write(outfile)
+        self._checkResult(outfile)
+
+    def test_parse_value(self):
+        for value in ('0', '-0', '+12', '-12345', '1234567', '123456789', '00012'):
+            for format in ((2, 4), (3, 4), (2, 5), (4, 6)):
+                for zero_suppression in ('leading', 'trailing', 'none'):
+                    self.assertEqual(
+                        repr(gerberex.rs274x.parse_value(value, format, zero_suppression)),
+                        repr(parse_gerber_value(value, format, zero_suppression)))
+
+    def test_value_formatter(self):
+        values = (0., -0., 1e-9, -4e-6, 5e-6, 1.5e-5, 2.5e-5, -0.6042805, 99.999995,
+                  123.456785, 1234.5, -232401.3999995, 1e7)
+        for format in ((2, 4), (3, 4), (2, 5), (4, 6), (6, 7), (3, 0)):
+            for zero_suppression in ('leading', 'trailing', 'none'):
+                expect = [write_gerber_value(v, format, zero_suppression) for v in values]
+                formatter = value_formatter(format, zero_suppression)
+                self.assertEqual([formatter(v) for v in values], expect)
+                if gerberex.rs274x.is_columns_available():
+                    column = numpy.array(values + (float('nan'),))
+                    self.assertEqual(
+                        format_column(column, 'X', format, zero_suppression),
+                        ['X' + v for v in expect] + [''])
+
+    def test_fast_tokenizer(self):
+        def dump(statements):
+            return [str(s) + repr(sorted(vars(s).items())) for s in statements]
+        for path in (self.METRIC_FILE, self.INCH_FILE, self.SQ_FILE):
+            with open(path, 'r') as f:
+                data = f.read()
+            base = gerber.rs274x.GerberParser
+            parser = gerberex.rs274x.GerberParser()
+            expect = dump(base._parse(parser, base._split_commands(parser, data)))
+            parser = gerberex.rs274x.GerberParser()
+            self.assertEqual(dump(parser._parse(parser._split_commands(data))), expect)
+
+    def test_block_remainder(self):
+        # text left after a block must be prepended to next command
+        commands = ('%FSLAX24Y24*%', '%MOIN*%', 'G04 note*X100', 'Y200D02*')
+        parser = gerberex.rs274x.GerberParser()
+        statements = list(parser._parse(commands))
+        self.assertEqual(len(statements), 4)
+        self.assertEqual(statements[2].comment, ' note')
+        self.assertEqual((statements[3].x, statements[3].y), (0.01, 0.02))
+
 if __name__ == '__main__':
     unittest.main()